@@ -1,20 +1,34 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, has_request_context
 import requests
 import logging
-import re
 import time
 import json
 import random
 from threading import Lock
 import os
+import sys
 
-app = Flask(__name__, template_folder='../templates')
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
 
-# Set up logging with more detailed format
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
-)
+# Shared modules live at the repository root
+sys.path.insert(0, ROOT)
+import ollama_client
+from code_formatter import format_code_response, StreamingCodeFormatter
+from static_responses import precompute
+from model_routing import KeywordClassifier
+from prompt_templates import template_for, is_social_media_request, SOCIAL_MEDIA
+from structured_logging import configure_logging, log_fields, describe_text
+
+# Absolute, since the page is rendered at import time and the module may be loaded by path
+app = Flask(__name__, template_folder=os.path.join(ROOT, 'templates'))
+
+def log_context():
+    """Client added to every record logged while handling a request"""
+    return {"client": request.remote_addr} if has_request_context() else None
+
+# The same JSON lines and LOG_* settings as the app, with user text hashed rather than
+# logged; written as they happen, since the function may be frozen between requests
+configure_logging(log_context, background=False)
 logger = logging.getLogger(__name__)
 
 # Rate limiting
@@ -22,66 +36,60 @@ request_lock = Lock()
 last_request_time = {}
 MIN_REQUEST_INTERVAL = 0.5
 
-def format_code_response(response):
-    if not response:
-        return "I apologize, but I couldn't generate a response. Please try again with a simpler question."
-        
-    # If response already contains our markers, return as is
-    if '[CODE]' in response:
-        return response
-        
-    # Check if response contains markdown code blocks
-    code_patterns = {
-        'html': r'```(?:html)?\n(.*?)```',
-        'css': r'```(?:css)?\n(.*?)```',
-        'python': r'```(?:python)?\n(.*?)```'
-    }
-    
-    formatted_response = response
-    
-    for lang, pattern in code_patterns.items():
-        matches = re.findall(pattern, response, re.DOTALL)
-        if matches:
-            for code_block in matches:
-                formatted_response = formatted_response.replace(
-                    f'```{lang}\n{code_block}```',
-                    f'[CODE]{code_block.strip()}[/CODE]'
-                ).replace(
-                    f'```\n{code_block}```',
-                    f'[CODE]{code_block.strip()}[/CODE]'
-                )
-    
-    # If no code blocks found but response looks like code
-    if not '[CODE]' in formatted_response:
-        code_indicators = {
-            'html': ['<html', '<body', '<div', '<p', '<script', '<style'],
-            'css': ['{', 'body {', '.class', '#id', '@media'],
-            'python': ['def ', 'class ', 'print(', 'return ', 'import ']
-        }
-        
-        for lang, indicators in code_indicators.items():
-            if any(indicator in formatted_response for indicator in indicators):
-                lines = formatted_response.split('\n')
-                code_lines = []
-                in_code = False
-                
-                for line in lines:
-                    if any(indicator in line for indicator in indicators):
-                        in_code = True
-                    if in_code:
-                        code_lines.append(line)
-                        
-                if code_lines:
-                    code_block = '\n'.join(code_lines)
-                    formatted_response = f'Here\'s the {lang.upper()} code:\n\n[CODE]{code_block.strip()}[/CODE]'
-                    break
-    
-    return formatted_response
+classify = KeywordClassifier()
 
-def generate_fallback_response(prompt):
-    """Generate a fallback response when external API is not available"""
-    if "website" in prompt.lower() and "social media" in prompt.lower():
-        return """Here's a simple social media website template:
+def build_ollama_payload(prompt, stream=False):
+    template = SOCIAL_MEDIA if is_social_media_request(prompt) else template_for(classify(prompt))
+    return template.apply({
+        "model": "codellama",
+        "prompt": template.render(prompt),
+        "stream": stream,
+        "num_predict": 256,
+        "num_ctx": 512
+    })
+
+def generate_ollama_response(prompt):
+    """Try a configured Ollama server once, returning None so callers can fall back"""
+    if not os.environ.get('OLLAMA_API_URL'):
+        return None
+    try:
+        response = ollama_client.post_generate(
+            build_ollama_payload(prompt),
+            timeout=20  # Stay well inside serverless execution limits
+        )
+        if response.status_code == 200:
+            return response.json().get('response') or None
+        logger.warning(f"Ollama returned status code {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Ollama unavailable, using fallback response: {str(e)}")
+    return None
+
+def stream_ollama_tokens(prompt):
+    """Yield answer tokens from a configured Ollama server; yields nothing when none is reachable"""
+    if not os.environ.get('OLLAMA_API_URL'):
+        return
+    try:
+        with ollama_client.post_generate(build_ollama_payload(prompt, stream=True), stream=True,
+                                         timeout=(5, 20)) as response:
+            if response.status_code != 200:
+                logger.warning(f"Ollama returned status code {response.status_code}")
+                return
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    logger.warning(f"Ollama stopped with an error: {chunk['error']}")
+                    return
+                if chunk.get('response'):
+                    yield chunk['response']
+                if chunk.get('done'):
+                    return
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"Ollama unavailable, using fallback response: {str(e)}")
+
+FALLBACK_ANSWERS = {
+    'social_media': """Here's a simple social media website template:
 
 [CODE]
 <!DOCTYPE html>
@@ -152,10 +160,9 @@ def generate_fallback_response(prompt):
 </html>
 [/CODE]
 
-This creates a responsive social media links page with hover effects and modern styling."""
+This creates a responsive social media links page with hover effects and modern styling.""",
 
-    elif any(keyword in prompt.lower() for keyword in ['python', 'function', 'code']):
-        return """I'd be happy to help with Python code! Here's a basic example:
+    'code': """I'd be happy to help with Python code! Here's a basic example:
 
 [CODE]
 def hello_world(name="World"):
@@ -169,10 +176,9 @@ print(hello_world())  # Output: Hello, World!
 print(hello_world("Alice"))  # Output: Hello, Alice!
 [/CODE]
 
-For more specific help, please describe what you'd like to build and I'll provide a tailored solution."""
+For more specific help, please describe what you'd like to build and I'll provide a tailored solution.""",
 
-    else:
-        return """I'm SOUR, your coding assistant! I can help you with:
+    'general': """I'm SOUR, your coding assistant! I can help you with:
 
 • Python programming and best practices
 • Web development (HTML, CSS, JavaScript)
@@ -181,26 +187,52 @@ For more specific help, please describe what you'd like to build and I'll provid
 • Project structure and design patterns
 
 Please ask me a specific coding question and I'll provide detailed examples with explanations!"""
+}
+
+def fallback_kind(prompt):
+    """Which canned answer fits the prompt"""
+    if is_social_media_request(prompt):
+        return 'social_media'
+    elif any(keyword in prompt.lower() for keyword in ['python', 'function', 'code']):
+        return 'code'
+    return 'general'
+
+def generate_fallback_response(prompt):
+    """Generate a fallback response when external API is not available"""
+    return FALLBACK_ANSWERS[fallback_kind(prompt)]
+
+# The page and the formatted fallback answers are the same for every request, so they are
+# rendered and compressed once per cold start. The page may be kept by the CDN until the
+# next deployment; POST answers can't be cached there, but repeats cost only a dict lookup
+with app.app_context():
+    pages = precompute({'index': render_template('index.html')}, 'text/html; charset=utf-8',
+                       'public, max-age=300, s-maxage=86400')
+formatted_fallbacks = {kind: format_code_response(text) for kind, text in FALLBACK_ANSWERS.items()}
+fallback_responses = precompute(
+    {kind: json.dumps({"response": text}) for kind, text in formatted_fallbacks.items()}, 'application/json'
+)
 
 @app.route('/')
 def home():
-    return render_template('index.html')
+    return pages['index'].respond(request)
 
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
         data = request.json
         user_message = data.get('message', '').strip()
-        client_ip = request.remote_addr
         
         if not user_message:
             return jsonify({"error": "Please enter a message"}), 400
             
-        logger.info(f"Received message from {client_ip}: {user_message}")
+        logger.info("Received message", extra=log_fields(sampled=True, user_message=describe_text(user_message)))
         
-        # For Vercel deployment, we'll use fallback responses since Ollama won't be available
-        # In a production environment, you would integrate with a cloud-based AI service
-        response_text = generate_fallback_response(user_message)
+        # For Vercel deployment, we'll use fallback responses unless OLLAMA_API_URL points
+        # at a reachable Ollama server
+        response_text = generate_ollama_response(user_message)
+        if not response_text:
+            logger.info("Answering with a precomputed fallback response")
+            return fallback_responses[fallback_kind(user_message)].respond(request)
         formatted_response = format_code_response(response_text)
         
         logger.info("Response generated successfully")
@@ -211,6 +243,37 @@ def chat():
         logger.error(f"Unexpected error in chat endpoint: {str(e)}")
         return jsonify({"error": error_msg}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """The same NDJSON events as app.py's /chat/stream, so the shared page works here too"""
+    data = request.json or {}
+    user_message = data.get('message', '').strip()
+    if not user_message:
+        return jsonify({"error": "Please enter a message"}), 400
+    logger.info("Received streaming message", extra=log_fields(sampled=True, user_message=describe_text(user_message)))
+    
+    def generate():
+        formatter = StreamingCodeFormatter()
+        pieces = []
+        for token in stream_ollama_tokens(user_message):
+            text = formatter.feed(token)
+            if text:
+                pieces.append(text)
+                yield json.dumps({"type": "token", "text": text}) + "\n"
+        text = formatter.flush()
+        if text:
+            pieces.append(text)
+            yield json.dumps({"type": "token", "text": text}) + "\n"
+        # Without a reachable Ollama server the precomputed fallback arrives as the final answer
+        response_text = format_code_response(''.join(pieces)) if pieces else \
+            formatted_fallbacks[fallback_kind(user_message)]
+        yield json.dumps({"type": "done", "response": response_text}) + "\n"
+        
+    return Response(generate(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # For Vercel deployment
 def handler(request):
     return app(request.environ, lambda status, headers: None)
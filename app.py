@@ -1,239 +1,864 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, g, has_request_context, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
 import requests
 import logging
-import re
 import time
 import json
 import random
+import math
 import os
-from threading import Lock
+import secrets
+import contextvars
+from threading import Event
+from contextlib import contextmanager
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+
+import ollama_client
+from code_formatter import format_code_response, StreamingCodeFormatter
+from response_cache import create_cache, make_cache_key
+from semantic_cache import create_semantic_cache
+from prompt_chunking import split_prompt, estimate_tokens
+from single_flight import SingleFlight, CancelledError
+from rate_limiter import create_rate_limiter
+from sessions import create_session_store, refers_back
+from resilience import create_latency_tracker, create_retry_budget
+from backend_pool import create_backend_pool, NoBackendAvailableError
+from model_lifecycle import create_model_keeper
+from batch_jobs import create_batch_manager, JobNotFoundError
+import metrics as prometheus
+from request_queue import (create_admission_queue, QueueFullError, QueueTimeoutError, QueueCancelledError,
+                           PRIORITY_INTERACTIVE, PRIORITY_BULK)
+from client_disconnect import create_disconnect_monitor, client_socket
+from model_routing import create_model_router, TemplatedRoute
+from structured_logging import configure_logging, log_fields, describe_text
+from prompt_templates import template_for, is_social_media_request, SOCIAL_MEDIA, TEMPLATES
 
 app = Flask(__name__)
 
-# Set up logging with more detailed format
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
-)
+# Behind a reverse proxy every request comes from the proxy's address, so rate limits,
+# fair queuing and logs would treat all users as one client. With TRUSTED_PROXIES set to
+# the number of proxies in front of the app, the client is taken from X-Forwarded-For
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+def log_context():
+    """Request id and client added to every record logged while handling a request"""
+    if not has_request_context():
+        return None
+    return {"request_id": g.get('request_id'), "client": request.remote_addr}
+
+# JSON log lines written from a background thread, with user text hashed rather
+# than logged; configured by LOG_*
+async_logging = configure_logging(log_context)
 logger = logging.getLogger(__name__)
 
-# Rate limiting
-request_lock = Lock()
-last_request_time = {}
-MIN_REQUEST_INTERVAL = 0.5  # Reduced minimum time between requests
+# Per-client rate limiting, configured by the RATE_LIMIT_* environment variables
+rate_limiter = create_rate_limiter()
 
-def format_code_response(response):
-    if not response:
-        return "I apologize, but I couldn't generate a response. Please try again with a simpler question."
-        
-    # If response already contains our markers, return as is
-    if '[CODE]' in response:
-        return response
-        
-    # Check if response contains markdown code blocks
-    code_patterns = {
-        'html': r'```(?:html)?\n(.*?)```',
-        'css': r'```(?:css)?\n(.*?)```',
-        'python': r'```(?:python)?\n(.*?)```'
-    }
-    
-    formatted_response = response
-    
-    for lang, pattern in code_patterns.items():
-        matches = re.findall(pattern, response, re.DOTALL)
-        if matches:
-            for code_block in matches:
-                formatted_response = formatted_response.replace(
-                    f'```{lang}\n{code_block}```',
-                    f'[CODE]{code_block.strip()}[/CODE]'
-                ).replace(
-                    f'```\n{code_block}```',
-                    f'[CODE]{code_block.strip()}[/CODE]'
-                )
-    
-    # If no code blocks found but response looks like code
-    if not '[CODE]' in formatted_response:
-        code_indicators = {
-            'html': ['<html', '<body', '<div', '<p', '<script', '<style'],
-            'css': ['{', 'body {', '.class', '#id', '@media'],
-            'python': ['def ', 'class ', 'print(', 'return ', 'import ']
-        }
-        
-        for lang, indicators in code_indicators.items():
-            if any(indicator in formatted_response for indicator in indicators):
-                lines = formatted_response.split('\n')
-                code_lines = []
-                in_code = False
-                
-                for line in lines:
-                    if any(indicator in line for indicator in indicators):
-                        in_code = True
-                    if in_code:
-                        code_lines.append(line)
-                        
-                if code_lines:
-                    code_block = '\n'.join(code_lines)
-                    formatted_response = f'Here\'s the {lang.upper()} code:\n\n[CODE]{code_block.strip()}[/CODE]'
-                    break
-    
-    return formatted_response
-
-def chunk_prompt(prompt, max_length=100):  # Reduced chunk size for faster processing
-    """Break down long prompts into smaller, manageable chunks"""
-    words = prompt.split()
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for word in words:
-        if current_length + len(word) + 1 <= max_length:
-            current_chunk.append(word)
-            current_length += len(word) + 1
-        else:
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [word]
-            current_length = len(word)
+# Bounded queue limiting how many requests generate at once, configured by QUEUE_*
+admission_queue = create_admission_queue()
+QUEUE_POSITION_INTERVAL = 1.0  # Seconds between queue position updates to streaming clients
+
+# Chunks of long prompts are generated in parallel on a shared pool, which also caps
+# how many chunk generations all requests together can send to Ollama at once
+CHUNK_CONCURRENCY = int(os.environ.get('CHUNK_CONCURRENCY', 4))
+chunk_executor = ThreadPoolExecutor(max_workers=CHUNK_CONCURRENCY, thread_name_prefix='chunk')
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', 24))  # Context repeated from the previous chunk
+MIN_CHUNK_TOKENS = int(os.environ.get('MIN_CHUNK_TOKENS', 64))  # Floor for routes whose options leave less
+
+def submit_chunk(fn, *args):
+    """Run fn on the chunk pool in a copy of the caller's context, so its stage timings
+    and log records still belong to the request"""
+    return chunk_executor.submit(contextvars.copy_context().run, fn, *args)
+# Chunk answers are combined by one more generation with a larger context window;
+# with CHUNK_MERGE=0 they are joined, and streamed as each chunk finishes
+CHUNK_MERGE = os.environ.get('CHUNK_MERGE', '1').lower() not in ('0', 'false', 'no')
+MERGE_NUM_CTX = int(os.environ.get('MERGE_NUM_CTX', 2048))
+
+# Cache of finished responses, configured by the RESPONSE_CACHE_* environment variables
+response_cache = create_cache()
+
+# Answers for earlier questions worded differently, configured by SEMANTIC_CACHE*
+semantic_cache = create_semantic_cache()
+
+# Concurrent identical prompts share one in-flight Ollama generation
+generation_flights = SingleFlight('generate')
+stream_flights = SingleFlight('stream')
+
+# Stops generating answers for /chat clients that hang up (CANCEL_ON_DISCONNECT);
+# streams stop on their own when writing to the closed connection fails
+disconnect_monitor = create_disconnect_monitor()
+
+# Conversation state for follow-up questions, configured by SESSION_*
+session_store = create_session_store()
+SESSION_NUM_CTX = int(os.environ.get('SESSION_NUM_CTX', 2048))  # Room for the carried-over context
+
+# Ollama servers from OLLAMA_API_URL, each behind its own circuit breaker so requests
+# fail fast (or move to another server) while one is down; configured by OLLAMA_*
+# and BREAKER_*. Timeouts follow observed latency (TIMEOUT_*) and retries are kept
+# to a fraction of traffic (RETRY_BUDGET_*)
+ollama_pool = create_backend_pool()
+
+# Picks the model and options for each message: general, code or long prompts;
+# configured by ROUTING_CLASSIFIER and ROUTE_<GENERAL|CODE|LONG>_MODEL / _OPTIONS
+model_router = create_model_router(ollama_client.DEFAULT_MODEL)
+
+# Preloads every routed model on every server and keeps them loaded while there is traffic;
+# configured by OLLAMA_KEEP_ALIVE, MODEL_WARMUP and MODEL_PING_INTERVAL
+model_keeper = create_model_keeper(ollama_pool, [route.model for route in model_router.routes.values()])
+model_keeper.start()
+latency_tracker = create_latency_tracker()      # Whole non-streaming generations
+first_token_tracker = create_latency_tracker()  # Wait for the first streamed chunk
+retry_budget = create_retry_budget()
+
+# Metrics served at /metrics; SERVER_TIMING=1 also reports each /chat request's
+# stage timings in a Server-Timing response header
+metrics = prometheus.MetricsRegistry('sour')
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+http_requests = metrics.counter('http_requests_total', 'HTTP requests by endpoint and status', ('endpoint', 'status'))
+http_request_seconds = metrics.histogram('http_request_duration_seconds', 'Time to produce a response (until headers for streams)', ('endpoint',))
+stage_seconds = metrics.histogram('stage_duration_seconds', 'Time spent in each stage of answering a message', ('stage',))
+cache_lookups = metrics.counter('cache_lookups_total', 'Response cache lookups', ('result',))
+ollama_requests = metrics.counter('ollama_requests_total', 'Requests sent to Ollama by outcome', ('outcome',))
+ollama_retries = metrics.counter('ollama_retries_total', 'Ollama requests that were retries of a failed attempt')
+prompt_chunks = metrics.histogram('prompt_chunks', 'Chunks a long prompt was split into', buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32))
+eval_tokens = metrics.counter('ollama_eval_tokens_total', 'Tokens generated by Ollama (eval_count)')
+prompt_eval_tokens = metrics.counter('ollama_prompt_eval_tokens_total', 'Prompt tokens processed by Ollama (prompt_eval_count)')
+eval_seconds = metrics.histogram('ollama_eval_duration_seconds', 'Generation time reported by Ollama (eval_duration)')
+prompt_eval_seconds = metrics.histogram('ollama_prompt_eval_duration_seconds', 'Prompt processing time reported by Ollama (prompt_eval_duration)')
+tokens_per_second = metrics.histogram('ollama_tokens_per_second', 'Generation speed, eval_count / eval_duration',
+                                      buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 200))
+generations_cancelled = metrics.counter('ollama_generations_cancelled_total', 'Generations stopped early because nobody was waiting for the answer any more')
+gpu_seconds_saved = metrics.counter('ollama_gpu_seconds_saved_total', 'Estimated generation time saved by stopping abandoned generations')
+route_requests = metrics.counter('route_requests_total', 'Messages answered by the model of each route, by outcome', ('route', 'outcome'))
+route_seconds = metrics.histogram('route_duration_seconds', 'Time for a route\'s model to answer a message', ('route',))
+queue_gauge = metrics.gauge('queue_requests', 'Requests generating or waiting for a slot', ('state',))
+backend_outstanding = metrics.gauge('ollama_backend_outstanding', 'Requests in flight per Ollama server', ('backend',))
+backend_healthy = metrics.gauge('ollama_backend_healthy', 'Whether an Ollama server passed its last health check', ('backend',))
+backend_model_loaded = metrics.gauge('ollama_model_loaded', 'Whether a routed model was loaded on an Ollama server when last checked', ('backend', 'model'))
+log_records_dropped = metrics.gauge('log_records_dropped', 'Log records not written, because of sampling or a full log queue', ('reason',))
+
+def collect_live_metrics():
+    queue = admission_queue.stats()
+    queue_gauge.set(queue["active"], state='active')
+    queue_gauge.set(queue["waiting"], state='waiting')
+    for backend in ollama_pool.stats()["backends"]:
+        backend_outstanding.set(backend["outstanding"], backend=backend["url"])
+        backend_healthy.set(int(backend["healthy"] and backend["circuit"] != 'open'), backend=backend["url"])
+    for backend in ollama_pool.backends:
+        for model in model_keeper.models:
+            backend_model_loaded.set(int(model_keeper.model_loaded(backend, model)), backend=backend.url, model=model)
+    logging_stats = async_logging.stats()
+    log_records_dropped.set(logging_stats["dropped_sampled"], reason='sampled')
+    log_records_dropped.set(logging_stats["dropped_queue_full"], reason='queue_full')
+
+metrics.add_collector(collect_live_metrics)
+
+def record_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+    if has_request_context():  # For the Server-Timing header and the request's log record
+        timings = g.setdefault('server_timing', {})
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+def record_route(route, seconds, outcome):
+    """Per-route latency and outcome of a message answered by the route's model"""
+    route.record(seconds, ok=outcome == 'ok')
+    route_requests.inc(route=route.name, outcome=outcome)
+    route_seconds.observe(seconds, route=route.name)
+
+@contextmanager
+def timed_stage(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+observed_tokens_per_second = None  # Moving average of generation speed, for estimating saved time
+
+def record_generation_stats(result):
+    """Record the token counts and timings Ollama reports with a finished generation"""
+    global observed_tokens_per_second
+    eval_count = result.get('eval_count') or 0
+    eval_duration = (result.get('eval_duration') or 0) / 1e9  # Reported in nanoseconds
+    eval_tokens.inc(eval_count)
+    prompt_eval_tokens.inc(result.get('prompt_eval_count') or 0)
+    if eval_duration:
+        eval_seconds.observe(eval_duration)
+        if eval_count:
+            speed = eval_count / eval_duration
+            tokens_per_second.observe(speed)
+            observed_tokens_per_second = speed if observed_tokens_per_second is None else \
+                0.8 * observed_tokens_per_second + 0.2 * speed
+    if result.get('prompt_eval_duration'):
+        prompt_eval_seconds.observe(result['prompt_eval_duration'] / 1e9)
+
+def record_cancelled_generation(payload, tokens_generated):
+    """Count a generation stopped early, and the model time it would still have taken.
+
+    Ollama streams about one token per chunk, so the tokens left are roughly
+    num_predict minus the chunks received; at the observed speed that is the
+    time saved.
+    """
+    generations_cancelled.inc()
+    remaining = max(0, (payload.get('num_predict') or 0) - tokens_generated)
+    if observed_tokens_per_second:
+        gpu_seconds_saved.inc(remaining / observed_tokens_per_second)
+
+# Errors after which sibling chunks are cancelled instead of retried
+CONNECTION_ERROR = "Could not connect to Ollama"
+CIRCUIT_OPEN_ERROR = "Ollama is unavailable (no healthy backend)"
+RETRY_BUDGET_ERROR = "Retry budget exhausted"
+FATAL_CHUNK_ERRORS = (CONNECTION_ERROR, CIRCUIT_OPEN_ERROR)
+CANCELLED_ERROR = "Generation cancelled"
+
+def chunk_prompt(prompt, route=None):
+    """Split a prompt that doesn't fit the context window into as few chunks as possible"""
+    return split_prompt(prompt, chunk_token_budget(route), CHUNK_OVERLAP_TOKENS)
+
+def prompt_room(route=None):
+    """Prompt tokens that fit in num_ctx next to the answer and the per-chunk instructions"""
+    payload = build_generate_payload('', route=route)
+    return payload["num_ctx"] - payload["num_predict"] - estimate_tokens(CHUNK_PROMPT_TEMPLATE) - \
+        estimate_tokens(payload.get("system", ''))
+
+def chunk_token_budget(route=None):
+    """Prompt tokens per chunk; never below MIN_CHUNK_TOKENS, so a tight route config
+    truncates chunks instead of splitting every prompt into one-token pieces"""
+    return max(prompt_room(route), MIN_CHUNK_TOKENS)
+
+CHUNK_PROMPT_TEMPLATE = """This is part {index} of {count} of a longer request. Respond to this part only; the answers to all parts will be combined afterwards.
+
+{chunk}"""
+
+MERGE_PROMPT_TEMPLATE = """The answers below each respond to one part of the same request. Combine them into a single coherent answer: remove repetition, keep every code block, and keep the [CODE] formatting.
+
+{answers}"""
+
+def build_chunk_prompts(chunks):
+    return [
+        CHUNK_PROMPT_TEMPLATE.format(index=index, count=len(chunks), chunk=chunk)
+        for index, chunk in enumerate(chunks, 1)
+    ]
+
+def join_chunk_responses(responses):
+    return '\n\n'.join(response.strip() for response in responses)
+
+def build_merge_payload(responses, stream=False, route=None):
+    """Payload for the reduce pass over chunk answers, or None when they don't fit MERGE_NUM_CTX"""
+    answers = '\n\n'.join(f"Answer to part {index}:\n{response.strip()}" for index, response in enumerate(responses, 1))
+    prompt = MERGE_PROMPT_TEMPLATE.format(answers=answers)
+    payload = build_generate_payload(prompt, stream, route)
+    if estimate_tokens(prompt) + estimate_tokens(payload.get("system", '')) + payload["num_predict"] > MERGE_NUM_CTX:
+        return None
+    payload["num_ctx"] = MERGE_NUM_CTX
+    return payload
+
+def merge_chunk_responses(responses, max_retries=5, route=None):
+    """Reduce the chunk answers to one answer with a final generation, falling back to joining them"""
+    payload = build_merge_payload(responses, route=route) if CHUNK_MERGE and len(responses) > 1 else None
+    if payload is not None:
+        with timed_stage('merge'):
+            merged, last_error = generate_single_response(payload["prompt"], max_retries, payload=payload, route=route)
+        if merged:
+            return merged
+        logger.warning(f"Merging chunk answers failed, joining them instead: {last_error}")
+    return join_chunk_responses(responses)
+
+def response_cache_key(prompt, route=None):
+    """Cache key for the prompt that is actually sent to Ollama"""
+    return make_cache_key(build_generate_payload(prompt, route=route))
+
+def generate_response_with_retry(prompt, max_retries=5, cancel_event=None, route=None):  # Increased retries for better reliability
+    """Return a cached response or generate one with retries and chunking.
+
+    Setting cancel_event abandons the request; the generation itself stops
+    once no other request is waiting for the same answer.
+    """
+    cache_key = response_cache_key(prompt, route)
+    if response_cache is not None:
+        cached = response_cache.get(cache_key)
+        cache_lookups.inc(result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return cached, None
             
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-        
-    return chunks
+    try:
+        return generation_flights.do(cache_key, _generate_and_cache, cache_key, prompt, max_retries, route,
+                                     cancel_event=cancel_event)
+    except CancelledError:
+        return None, CANCELLED_ERROR
 
-def generate_response_with_retry(prompt, max_retries=5, client_ip=None):  # Increased retries for better reliability
+def _generate_and_cache(cache_key, prompt, max_retries, route=None, cancel_event=None):
+    response, last_error = generate_uncached_response(prompt, max_retries, cancel_event, route)
+    # A cancelled generation may have returned a partial answer
+    if response and response_cache is not None and not (cancel_event is not None and cancel_event.is_set()):
+        response_cache.set(cache_key, response)
+    return response, last_error
+
+def generate_uncached_response(prompt, max_retries=5, cancel_event=None, route=None):
     """Attempt to generate a response with retries and chunking for long prompts"""
-    # Optimized handling for social media website requests
-    if "website" in prompt.lower() and " social media" in prompt.lower():
-        template_prompt = """Complete this HTML template with social media links:
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Social Links</title>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.4/css/all.min.css">
-    <style>
-        body { 
-            display: flex; 
-            justify-content: center;
-            align-items: center;
-            min-height: 100vh;
-            margin: 0;
-            background: #f0f2f5;
-        }
-        .social-links {
-            display: flex;
-            gap: 20px;
-        }
-        .social-links a {
-            color: #1877f2;
-            font-size: 24px;
-            transition: transform 0.3s;
-        }
-        .social-links a:hover {
-            transform: scale(1.2);
-        }
-    </style>
-</head>
-<body>
-    <div class="social-links">
-        <!-- Add links for Twitter, Facebook, and Instagram using Font Awesome icons -->
-    </div>
-</body>
-</html>"""
-        try:
-            response, last_error = generate_single_response(template_prompt, max_retries, client_ip)
-            if response:
-                return response, None
-            logger.warning("Failed to generate social media website response")
-        except Exception as e:
-            logger.error(f"Error generating social media website: {str(e)}")
-        return None, "Error generating social media website"
-        
-    # For other types of prompts, use regular chunking
-    elif len(prompt) > 150:
-        chunks = chunk_prompt(prompt)
-        responses = []
-        last_error = None
-        
-        for chunk in chunks:
-            try:
-                chunk_response, chunk_error = generate_single_response(chunk, max_retries, client_ip)
-                if chunk_response:
-                    responses.append(chunk_response)
-                else:
-                    last_error = chunk_error
-                    logger.warning(f"Failed to generate response for chunk: {chunk}")
-            except Exception as e:
-                last_error = str(e)
-                logger.error(f"Error processing chunk: {str(e)}")
-                
+    # Prompts too long for the context window are answered in parts, then merged
+    chunks = chunk_prompt(prompt, route)
+    prompt_chunks.observe(len(chunks))
+    if len(chunks) > 1:
+        responses, last_error = generate_chunks_concurrently(build_chunk_prompts(chunks), max_retries, cancel_event, route)
+        # The event is also set when a chunk failed fatally, which leaves last_error set
+        if cancel_event is not None and cancel_event.is_set() and not last_error:
+            return None, CANCELLED_ERROR
         if responses:
-            return ' '.join(responses), None
+            return merge_chunk_responses(responses, max_retries, route), None
         return None, last_error
-    else:
-        return generate_single_response(prompt, max_retries, client_ip)
-
-def generate_single_response(prompt, max_retries=5, client_ip=None):
-    """Generate response for a single prompt with retries and rate limiting"""
-    if client_ip:
-        with request_lock:
-            current_time = time.time()
-            if client_ip in last_request_time:
-                time_since_last = current_time - last_request_time[client_ip]
-                if time_since_last < MIN_REQUEST_INTERVAL:
-                    time.sleep(MIN_REQUEST_INTERVAL - time_since_last)
-            last_request_time[client_ip] = current_time
+    return generate_single_response(
+        prompt, max_retries, cancel_event, payload=build_generate_payload(prompt, route=route), route=route
+    )
+
+def _generate_chunk(chunk, max_retries, cancel_event, route=None):
+    """Generate one chunk, cancelling its siblings if Ollama is unreachable"""
+    chunk_response, chunk_error = generate_single_response(
+        chunk, max_retries, cancel_event, payload=build_generate_payload(chunk, route=route), route=route
+    )
+    if chunk_error in FATAL_CHUNK_ERRORS:
+        cancel_event.set()
+    return chunk_response, chunk_error
+
+def generate_chunks_concurrently(chunks, max_retries=5, cancel_event=None, route=None):
+    """Generate chunk responses in parallel, returning them in chunk order.
+
+    cancel_event stops all chunks; it is also set when one of them fails fatally.
+    """
+    if cancel_event is None:
+        cancel_event = Event()
+    futures = [
+        submit_chunk(_generate_chunk, chunk, max_retries, cancel_event, route)
+        for chunk in chunks
+    ]
+    responses = []
+    last_error = None
     
+    for index, future in enumerate(futures):
+        try:
+            chunk_response, chunk_error = future.result()
+        except Exception as e:
+            chunk_response, chunk_error = None, str(e)
+            logger.error(f"Error processing chunk: {str(e)}")
+            
+        if chunk_response:
+            responses.append(chunk_response)
+            continue
+            
+        if chunk_error != CANCELLED_ERROR:
+            last_error = chunk_error
+        logger.warning(f"Failed to generate response for chunk {index + 1} of {len(chunks)}")
+        
+    return responses, last_error
+
+def build_generate_payload(prompt, stream=False, route=None):
+    """Build the Ollama /api/generate request body for a prompt, for the route's model if given"""
+    payload = model_keeper.apply({
+        "model": ollama_client.DEFAULT_MODEL,
+        "prompt": prompt,
+        "stream": stream,
+        "context_window": 512,   # Minimal context for fastest responses
+        "num_predict": 256,      # Very concise responses
+        "temperature": 0.8,      # More deterministic responses
+        "top_p": 0.8,           # More deterministic token selection
+        "repeat_penalty": 1.1,   # Lighter repetition prevention
+        "stop": ["</code>", "```", "\n\n\n"],  # Clean response endings
+        "num_ctx": 512          # Minimal context window for fastest processing
+    })
+    return route.apply(payload) if route is not None else payload
+
+# A route whose num_predict and instructions leave almost nothing of num_ctx is a config mistake
+for route in model_router.routes.values():
+    for template in TEMPLATES.values():
+        room = prompt_room(TemplatedRoute(route, template))
+        if room < MIN_CHUNK_TOKENS:
+            logger.warning(
+                f"Route {route.name} with the {template.name} template leaves {room} prompt tokens in num_ctx; "
+                f"chunks use {MIN_CHUNK_TOKENS} and may be truncated. Raise num_ctx or lower num_predict"
+            )
+
+def check_attempt_allowed(attempt):
+    """Return an error if the retry budget forbids this attempt, otherwise None"""
+    if attempt > 0:
+        if not retry_budget.try_retry():
+            return RETRY_BUDGET_ERROR
+        ollama_retries.inc()
+    return None
+
+def read_generation(response, payload, started, deadline, cancel_event=None):
+    """Collect a streamed generation into one result like Ollama's non-streamed reply.
+
+    Returns None if cancel_event is set first; leaving the stream unread then
+    closes the connection, which makes Ollama stop generating.
+    """
+    pieces = []
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if chunk.get('error'):
+            raise GenerationError(chunk['error'])
+        pieces.append(chunk.get('response', ''))
+        if chunk.get('done'):
+            chunk['response'] = ''.join(pieces)
+            return chunk
+        if cancel_event is not None and cancel_event.is_set():
+            record_cancelled_generation(payload, len(pieces))
+            return None
+        if time.monotonic() - started > deadline:
+            raise requests.exceptions.ReadTimeout(f"Generation took longer than {deadline:.0f}s")
+    raise GenerationError("Ollama closed the stream before the answer was complete")
+
+def generate_single_response(prompt, max_retries=5, cancel_event=None, payload=None, details=None, route=None):
+    """Generate response for a single prompt with retries.
+
+    payload overrides the default request body, and details (a dict) receives the
+    full Ollama result, e.g. the conversation context. The answer is streamed from
+    Ollama and collected, so setting cancel_event stops it mid-generation. The
+    timeout follows the route's observed latency, or all generations' without one.
+    """
+    if payload is None:
+        payload = build_generate_payload(prompt)
     last_error = None
     backoff_time = 1  # Reduced initial backoff time
+    retry_budget.record_request()
     
     for attempt in range(max_retries):
+        if cancel_event is not None and cancel_event.is_set():
+            return None, CANCELLED_ERROR
+        blocked = check_attempt_allowed(attempt)
+        if blocked:
+            last_error = blocked
+            break
         try:
-            OLLAMA_API_URL = os.environ.get('OLLAMA_API_URL', 'http://localhost:11434')
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={
-                    "model": "codellama",
-                    "prompt": prompt,
-                    "stream": False,  # Disable streaming for now as we need to modify response handling
-                    "context_window": 512,   # Minimal context for fastest responses
-                    "num_predict": 256,      # Very concise responses
-                    "temperature": 0.8,      # More deterministic responses
-                    "top_p": 0.8,           # More deterministic token selection
-                    "repeat_penalty": 1.1,   # Lighter repetition prevention
-                    "stop": ["</code>", "```", "\n\n\n"],  # Clean response endings
-                    "num_ctx": 512          # Minimal context window for fastest processing
-                },
-                timeout=120  # Increased timeout for complex responses
-            )
-            
+            result = None
+            with ollama_pool.backend(payload.get('model')) as backend:
+                started = time.monotonic()
+                # Adapts to observed generation times, which a slower route's model must not inherit
+                timeout = (route.latency if route is not None else latency_tracker).timeout()
+                with timed_stage('ollama'), ollama_client.post_generate(
+                    dict(payload, stream=True),
+                    stream=True,
+                    timeout=timeout,
+                    base_url=backend.url
+                ) as response:
+                    if response.status_code == 200:
+                        result = read_generation(response, payload, started, timeout, cancel_event)
+            elapsed = time.monotonic() - started
+            ollama_requests.inc(outcome=response.status_code)
+                
             if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, dict):
-                    return result.get('response', ''), None
-                return str(result), None
+                if result is None:
+                    ollama_pool.record_result(backend, response.status_code)
+                    return None, CANCELLED_ERROR
+                ollama_pool.record_result(backend, response.status_code, elapsed)
+                latency_tracker.record(elapsed)
+                record_generation_stats(result)
+                if details is not None:
+                    details.update(result)
+                return result.get('response', ''), None
                 
+            ollama_pool.record_result(backend, response.status_code, elapsed)
             last_error = f"API returned status code {response.status_code}"
             
+        except NoBackendAvailableError:
+            ollama_requests.inc(outcome='no_backend')
+            last_error = CIRCUIT_OPEN_ERROR
+            break
         except requests.exceptions.Timeout:
+            ollama_pool.record_result(backend)
+            ollama_requests.inc(outcome='timeout')
             last_error = "Request timed out"
-            logger.warning(f"Timeout on attempt {attempt+1} for prompt: {prompt}")
+            logger.warning(f"Timeout on attempt {attempt+1}",
+                           extra=log_fields(attempt=attempt + 1, prompt=describe_text(prompt)))
         except requests.exceptions.ConnectionError:
-            last_error = "Could not connect to Ollama"
-            logger.warning(f"Connection error on attempt {attempt+1} for prompt: {prompt}")
+            ollama_pool.record_result(backend)
+            ollama_requests.inc(outcome='connection_error')
+            last_error = CONNECTION_ERROR
+            logger.warning(f"Connection error on attempt {attempt+1}",
+                           extra=log_fields(attempt=attempt + 1, prompt=describe_text(prompt)))
         except Exception as e:
             last_error = str(e)
-            logger.warning(f"Exception on attempt {attempt+1} for prompt: {prompt} - {last_error}")
+            logger.warning(f"Exception on attempt {attempt+1}: {last_error}",
+                           extra=log_fields(attempt=attempt + 1, prompt=describe_text(prompt)))
             
         # Exponential backoff with jitter
         if attempt < max_retries - 1:
             jitter = random.uniform(0, 0.5)  # Increased jitter range
-            time.sleep(backoff_time + jitter)
+            if cancel_event is not None:
+                cancel_event.wait(backoff_time + jitter)  # Wake early if siblings failed fatally
+            else:
+                time.sleep(backoff_time + jitter)
             backoff_time *= 1.5  # Gentler backoff multiplier
             
     logger.error(f"Failed after {max_retries} attempts. Last error: {last_error}")
     return None, last_error
 
+def session_history(session, prompt, route=None):
+    """The (context, transcript) a follow-up is sent with, or None when it doesn't fit next to either.
+
+    The carried context is preferred; a message too long to fit beside it gets
+    the shorter condensed transcript instead.
+    """
+    payload = build_generate_payload('', route=route)
+    room = (SESSION_NUM_CTX - payload["num_predict"] - estimate_tokens(payload.get("system", ''))
+            - estimate_tokens(prompt))
+    if session.context and len(session.context) <= room:
+        return session.context, ''
+    transcript = session.transcript()
+    if estimate_tokens(transcript) <= room:
+        return None, transcript
+    return None
+
+def continues_session(session, user_message, prompt, route=None):
+    """Whether a message is answered with its session's history rather than like a new question.
+
+    Only messages that refer back to earlier turns need it; the rest, and
+    follow-ups too long to fit beside the history, take the cached, coalesced
+    and chunked path.
+    """
+    return (session.has_history() and refers_back(user_message)
+            and session_history(session, prompt, route) is not None)
+
+def build_session_payload(session, prompt, stream=False, route=None):
+    """Request body for a follow-up that continues the session's conversation"""
+    context, transcript = session_history(session, prompt, route) or (None, '')
+    payload = build_generate_payload(transcript + prompt, stream, route)
+    payload["num_ctx"] = SESSION_NUM_CTX
+    if context:
+        payload["context"] = context
+        payload.pop("system", None)  # Already in the context, from the turn that produced it
+    return payload
+
+def generate_session_response(session, prompt, max_retries=5, cancel_event=None, route=None):
+    """Generate a follow-up within a conversation, returning (response, error, context).
+
+    Follow-ups depend on the conversation, so they bypass the response cache and
+    are sent as a single generation rather than in chunks; continues_session
+    only sends the ones that fit here.
+    """
+    details = {}
+    response, last_error = generate_single_response(
+        prompt, max_retries, cancel_event, payload=build_session_payload(session, prompt, route=route), details=details,
+        route=route
+    )
+    return response, last_error, details.get('context')
+
+class GenerationError(Exception):
+    """Raised when a streamed generation fails before producing any output"""
+
+def stream_single_response(prompt, max_retries=5, cancel_event=None, payload=None, details=None):
+    """Yield response tokens for a single prompt as Ollama generates them.
+
+    payload and details work as in generate_single_response; details receives the
+    final chunk of the stream.
+    """
+    if payload is None:
+        payload = build_generate_payload(prompt, stream=True)
+    last_error = None
+    backoff_time = 1
+    retry_budget.record_request()
+    
+    for attempt in range(max_retries):
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationError(CANCELLED_ERROR)
+        blocked = check_attempt_allowed(attempt)
+        if blocked:
+            last_error = blocked
+            break
+        produced = False
+        try:
+            # The backend stays counted as busy until the stream ends
+            with ollama_pool.backend(payload.get('model')) as backend:
+                started = time.monotonic()
+                with ollama_client.post_generate(
+                    payload,
+                    stream=True,
+                    timeout=first_token_tracker.timeout(),  # Applies between streamed chunks, not to the whole generation
+                    base_url=backend.url
+                ) as response:
+                    ollama_pool.record_result(backend, response.status_code)
+                    ollama_requests.inc(outcome=response.status_code)
+                    
+                    if response.status_code != 200:
+                        last_error = f"API returned status code {response.status_code}"
+                    else:
+                        first_line = True
+                        received = 0
+                        for line in response.iter_lines():
+                            if not line:
+                                continue
+                            if first_line:
+                                first_token_latency = time.monotonic() - started
+                                first_token_tracker.record(first_token_latency)
+                                ollama_pool.record_latency(backend, first_token_latency)
+                                record_stage('ollama_first_token', first_token_latency)
+                                first_line = False
+                            chunk = json.loads(line)
+                            if chunk.get('error'):
+                                raise GenerationError(chunk['error'])
+                            received += 1
+                            token = chunk.get('response', '')
+                            if token:
+                                produced = True
+                                try:
+                                    yield token
+                                except GeneratorExit:
+                                    # The consumer went away (e.g. the client disconnected); leaving
+                                    # the with blocks closes the connection so Ollama stops generating
+                                    record_cancelled_generation(payload, received)
+                                    raise
+                            if chunk.get('done'):
+                                record_generation_stats(chunk)
+                                if details is not None:
+                                    details.update(chunk)
+                                return
+                            if cancel_event is not None and cancel_event.is_set():
+                                record_cancelled_generation(payload, received)
+                                return
+                        return
+                    
+        except NoBackendAvailableError:
+            ollama_requests.inc(outcome='no_backend')
+            last_error = CIRCUIT_OPEN_ERROR
+            break
+        except requests.exceptions.Timeout:
+            ollama_pool.record_result(backend)
+            ollama_requests.inc(outcome='timeout')
+            last_error = "Request timed out"
+            logger.warning(f"Timeout on streaming attempt {attempt+1}",
+                           extra=log_fields(attempt=attempt + 1, prompt=describe_text(prompt)))
+        except requests.exceptions.ConnectionError:
+            ollama_pool.record_result(backend)
+            ollama_requests.inc(outcome='connection_error')
+            last_error = CONNECTION_ERROR
+            logger.warning(f"Connection error on streaming attempt {attempt+1}",
+                           extra=log_fields(attempt=attempt + 1, prompt=describe_text(prompt)))
+        except Exception as e:
+            last_error = str(e)
+            logger.warning(f"Exception on streaming attempt {attempt+1}: {last_error}",
+                           extra=log_fields(attempt=attempt + 1, prompt=describe_text(prompt)))
+            
+        # Tokens already sent to the client cannot be taken back, so only retry empty streams
+        if produced:
+            raise GenerationError(last_error)
+            
+        if attempt < max_retries - 1:
+            jitter = random.uniform(0, 0.5)
+            if cancel_event is not None:
+                cancel_event.wait(backoff_time + jitter)
+            else:
+                time.sleep(backoff_time + jitter)
+            backoff_time *= 1.5
+            
+    logger.error(f"Streaming failed after {max_retries} attempts. Last error: {last_error}")
+    raise GenerationError(last_error)
+
+def _stream_chunk_into(queue, chunk, max_retries, cancel_event, route=None):
+    """Pump one chunk's streamed tokens into a queue for the ordered consumer"""
+    try:
+        payload = build_generate_payload(chunk, stream=True, route=route)
+        for token in stream_single_response(chunk, max_retries, cancel_event, payload=payload):
+            queue.put(('token', token))
+        queue.put(('done', None))
+    except Exception as e:
+        if str(e) in FATAL_CHUNK_ERRORS:
+            cancel_event.set()
+        queue.put(('error', str(e)))
+
+def stream_chunks_concurrently(chunks, max_retries=5, route=None):
+    """Stream chunk responses in chunk order while later chunks generate in parallel"""
+    cancel_event = Event()
+    queues = [Queue() for _ in chunks]
+    futures = [
+        submit_chunk(_stream_chunk_into, queue, chunk, max_retries, cancel_event, route)
+        for queue, chunk in zip(queues, chunks)
+    ]
+    answered = 0
+    last_error = None
+    
+    try:
+        for index, queue in enumerate(queues):
+            first_token = True
+            pending = ''  # Trailing whitespace, sent only if more of the answer follows
+            while True:
+                kind, value = queue.get()
+                if kind == 'token':
+                    # Stripped and separated the way join_chunk_responses does, so /chat/stream
+                    # sends (and caches) the same text as /chat
+                    text = pending + (value.lstrip() if first_token else value)
+                    value = text.rstrip()
+                    pending = text[len(value):]
+                    if not value:
+                        continue
+                    if first_token and answered:
+                        yield '\n\n'
+                    first_token = False
+                    yield value
+                    continue
+                if kind == 'error':
+                    if value != CANCELLED_ERROR:
+                        last_error = value
+                    logger.warning(f"Failed to stream response for chunk {index + 1} of {len(chunks)}")
+                break
+                
+            if not first_token:
+                answered += 1
+    finally:
+        # Stop chunks still generating if the consumer finished early or went away
+        cancel_event.set()
+        for future in futures:
+            future.cancel()
+            
+    if not answered:
+        raise GenerationError(last_error)
+
+def stream_response_with_retry(prompt, max_retries=5, route=None):
+    """Streaming counterpart of generate_response_with_retry"""
+    cache_key = response_cache_key(prompt, route)
+    if response_cache is not None:
+        cached = response_cache.get(cache_key)
+        cache_lookups.inc(result='miss' if cached is None else 'hit')
+        if cached is not None:
+            yield cached
+            return
+            
+    yield from stream_flights.stream(
+        cache_key, lambda: _stream_and_cache(cache_key, prompt, max_retries, route)
+    )
+
+def _stream_and_cache(cache_key, prompt, max_retries, route=None):
+    pieces = []
+    for token in stream_uncached_response(prompt, max_retries, route):
+        pieces.append(token)
+        yield token
+    # Only reached when the stream ran to completion
+    if response_cache is not None:
+        response_cache.set(cache_key, ''.join(pieces))
+
+def stream_uncached_response(prompt, max_retries=5, route=None):
+    """Yield tokens for a prompt; long prompts stream the merged answer, or each chunk in order without merging"""
+    chunks = chunk_prompt(prompt, route)
+    prompt_chunks.observe(len(chunks))
+    if len(chunks) == 1:
+        yield from stream_single_response(prompt, max_retries, payload=build_generate_payload(prompt, True, route))
+    elif not CHUNK_MERGE:
+        yield from stream_chunks_concurrently(build_chunk_prompts(chunks), max_retries, route)
+    else:
+        responses, last_error = generate_chunks_concurrently(build_chunk_prompts(chunks), max_retries, route=route)
+        if not responses:
+            raise GenerationError(last_error)
+        payload = build_merge_payload(responses, stream=True, route=route) if len(responses) > 1 else None
+        if payload is None:
+            yield join_chunk_responses(responses)
+            return
+        # Nothing has been sent yet, so a failed merge can still fall back to the joined answers
+        produced = False
+        try:
+            for token in stream_single_response(payload["prompt"], max_retries, payload=payload):
+                produced = True
+                yield token
+        except GenerationError as e:
+            if produced:
+                raise
+            logger.warning(f"Merging chunk answers failed, joining them instead: {e}")
+            yield join_chunk_responses(responses)
+
+def route_message(user_message):
+    """Return (prompt, route) for a message, the route carrying the template's instructions.
+
+    The classifier picks the prompt template and the route; a prompt too
+    long for that route's context window goes to the long route instead.
+    """
+    category = model_router.classify(user_message)
+    template = SOCIAL_MEDIA if is_social_media_request(user_message) else template_for(category)
+    prompt = template.render(user_message)
+    route = model_router.route(category).with_template(template)
+    return prompt, model_router.route(category, len(chunk_prompt(prompt, route))).with_template(template)
+
+OLLAMA_UNAVAILABLE_MESSAGE = "Could not connect to the AI model. This usually means Ollama is not running.\n\n" \
+                             "Please ensure:\n" \
+                             "1. Ollama is running (check Task Manager)\n" \
+                             "2. CodeLlama model is installed (run: ollama pull codellama)\n" \
+                             "3. Your system has enough resources (at least 8GB RAM)\n" \
+                             "4. Try again in a few moments"
+
+def generation_error_message(last_error):
+    """User-facing message for a generation that produced no response"""
+    return f"I apologize, but I couldn't generate a response. Error: {last_error}\n\nPlease try:\n" \
+           "1. Breaking down your question into smaller parts\n" \
+           "2. Being more specific about what you need\n" \
+           "3. Asking for simpler examples first\n" \
+           "4. Waiting a moment before trying again"
+
+def check_rate_limit(client_ip):
+    """Return a 429 response if the client is over its rate limit, otherwise None"""
+    if rate_limiter is None or not client_ip:
+        return None
+    allowed, retry_after = rate_limiter.allow(client_ip)
+    if allowed:
+        return None
+    wait_seconds = max(1, math.ceil(retry_after))
+    response = jsonify({"error": f"You're sending messages too quickly. Please wait {wait_seconds} second(s) and try again."})
+    response.headers['Retry-After'] = str(wait_seconds)
+    return response, 429
+
+def request_class(prompt, route=None):
+    """Return (priority, cost) for the admission queue.
+
+    Questions answered in one generation are admitted ahead of prompts that
+    fan out into chunks, and the cost, the number of generations, is what
+    the queue shares fairly between clients.
+    """
+    chunks = len(chunk_prompt(prompt, route))
+    if chunks == 1:
+        return PRIORITY_INTERACTIVE, 1
+    return PRIORITY_BULK, chunks + (1 if CHUNK_MERGE else 0)
+
+def is_cached(prompt, route=None):
+    """Whether the prompt can be answered from cache without queueing for the model"""
+    return response_cache is not None and response_cache_key(prompt, route) in response_cache
+
+def semantic_namespace(route=None):
+    """Semantic cache entries are only shared between requests with the same model settings"""
+    return make_cache_key(build_generate_payload('', route=route))
+
+def find_similar_answer(user_message, route=None):
+    """The cached answer to an earlier, differently worded question, or None"""
+    if semantic_cache is None:
+        return None
+    try:
+        answer, similarity = semantic_cache.get(user_message, semantic_namespace(route))
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup failed: {e}")
+        return None
+    cache_lookups.inc(result='semantic_hit' if answer is not None else 'semantic_miss')
+    if answer is not None:
+        logger.info(f"Answering from semantic cache (similarity {similarity:.3f})")
+    return answer
+
+def remember_answer(user_message, response_text, route=None):
+    if semantic_cache is None or not response_text:
+        return
+    try:
+        semantic_cache.set(user_message, response_text, semantic_namespace(route))
+    except Exception as e:
+        logger.warning(f"Could not add answer to semantic cache: {e}")
+
+SERVER_BUSY_MESSAGE = "SOUR is busy answering other questions right now. Please try again in a few moments."
+
+def server_busy_response():
+    response = jsonify({"error": SERVER_BUSY_MESSAGE})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+def client_closed_response():
+    # Nobody reads this; 499 (as nginx logs it) keeps abandoned requests apart in metrics
+    return jsonify({"error": "Client closed the request"}), 499
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -249,55 +874,81 @@ def chat():
         if not user_message:
             return jsonify({"error": "Please enter a message"}), 400
             
-        logger.info(f"Received message from {client_ip}: {user_message}")
+        limited = check_rate_limit(client_ip)
+        if limited:
+            return limited
+            
+        logger.info("Received message", extra=log_fields(sampled=True, user_message=describe_text(user_message)))
+        model_keeper.record_activity()
         
-        # Enhance the prompt for better responses
-        keywords = ['code', 'function', 'class', 'example', 'python', 'javascript', 'html', 'css']
-        is_code_request = any(keyword in user_message.lower() for keyword in keywords)
+        enhanced_prompt, route = route_message(user_message)
+        session_id, session = session_store.get(data.get('session_id'))
+        conversational = continues_session(session, user_message, enhanced_prompt, route)
+        cached = not conversational and is_cached(enhanced_prompt, route)
+        similar_answer = None if conversational or cached else find_similar_answer(user_message, route)
         
-        if is_code_request:
-            enhanced_prompt = f"""Please provide a clear and concise code example for: {user_message}
-
-Requirements:
-1. Start with a brief explanation of the solution
-2. Include well-commented code with clear variable names
-3. Add example usage showing input and output
-4. Keep the code simple and efficient
-5. Use Python best practices and PEP 8 style
-
-Format the response like this:
-[Explanation of the solution]
-
-[CODE]
-# Your code here
-[/CODE]
-
-[Example usage]"""
-        else:
-            enhanced_prompt = f"""Please help with: {user_message}
-
-If code would be helpful, include:
-1. Clear explanation of the concept
-2. Relevant code examples in this format:
-   [CODE]
-   # Your code here
-   [/CODE]
-3. Key points to understand
-4. Common pitfalls to avoid"""
-            
-        # Generate response with improved error handling
-        response_text, last_error = generate_response_with_retry(enhanced_prompt, client_ip=client_ip)
+        # Set if the client hangs up, so neither the queue nor Ollama keeps working for it
+        cancel_event = Event()
+        watch = None
+        if disconnect_monitor is not None and not cached and similar_answer is None:
+            watch = disconnect_monitor.watch(client_socket(request.environ), cancel_event.set)
+        try:
+            ticket = None
+            if not cached and similar_answer is None:
+                try:
+                    priority, cost = request_class(enhanced_prompt, route)
+                    ticket = admission_queue.admit(priority, client=client_ip, cost=cost, cancel_event=cancel_event)
+                except (QueueFullError, QueueTimeoutError) as e:
+                    logger.warning(f"Request from {client_ip} not admitted: {e}")
+                    return server_busy_response()
+                except QueueCancelledError:
+                    logger.info(f"Client {client_ip} disconnected while queued")
+                    return client_closed_response()
+                record_stage('queue', ticket.wait_time)
+                    
+            # Generate response with improved error handling
+            context = None
+            started = time.perf_counter()
+            try:
+                with timed_stage('generate'):
+                    if conversational:
+                        response_text, last_error, context = generate_session_response(
+                            session, enhanced_prompt, cancel_event=cancel_event, route=route
+                        )
+                    elif similar_answer is not None:
+                        response_text, last_error = similar_answer, None
+                    else:
+                        response_text, last_error = generate_response_with_retry(
+                            enhanced_prompt, cancel_event=cancel_event, route=route
+                        )
+                        remember_answer(user_message, response_text, route)
+            finally:
+                if ticket is not None:
+                    admission_queue.release(ticket)
+            if ticket is not None:
+                outcome = 'cancelled' if cancel_event.is_set() else 'ok' if response_text else 'error'
+                record_route(route, time.perf_counter() - started, outcome)
+        finally:
+            if watch is not None:
+                disconnect_monitor.unwatch(watch)
         
+        if cancel_event.is_set():
+            logger.info(f"Client {client_ip} disconnected; stopped generating its answer")
+            return client_closed_response()
         if response_text:
-            formatted_response = format_code_response(response_text)
-            logger.info("Response generated successfully")
-            return jsonify({"response": formatted_response})
+            session.record_turn(user_message, response_text, context)
+            with timed_stage('format'):
+                formatted_response = format_code_response(response_text)
+            logger.info("Response generated successfully",
+                        extra=log_fields(sampled=True, route=route.name, response_chars=len(response_text)))
+            return jsonify({"response": formatted_response, "session_id": session_id})
+        elif last_error == CIRCUIT_OPEN_ERROR:
+            logger.error("Ollama circuit is open, failing fast")
+            response = jsonify({"error": OLLAMA_UNAVAILABLE_MESSAGE})
+            response.headers['Retry-After'] = str(math.ceil(ollama_pool.reset_timeout))
+            return response, 503
         else:
-            error_msg = f"I apologize, but I couldn't generate a response. Error: {last_error}\n\nPlease try:\n" \
-                       "1. Breaking down your question into smaller parts\n" \
-                       "2. Being more specific about what you need\n" \
-                       "3. Asking for simpler examples first\n" \
-                       "4. Waiting a moment before trying again"
+            error_msg = generation_error_message(last_error)
             logger.error(f"Failed to generate response. Last error: {last_error}")
             return jsonify({"error": error_msg}), 500
             
@@ -312,20 +963,308 @@ If code would be helpful, include:
         return jsonify({"error": error_msg}), 504
         
     except requests.exceptions.ConnectionError:
-        error_msg = "Could not connect to the AI model. This usually means Ollama is not running.\n\n" \
-                   "Please ensure:\n" \
-                   "1. Ollama is running (check Task Manager)\n" \
-                   "2. CodeLlama model is installed (run: ollama pull codellama)\n" \
-                   "3. Your system has enough resources (at least 8GB RAM)\n" \
-                   "4. Try again in a few moments"
         logger.error("Connection error to Ollama API")
-        return jsonify({"error": error_msg}), 503
+        return jsonify({"error": OLLAMA_UNAVAILABLE_MESSAGE}), 503
         
     except Exception as e:
         error_msg = f"An unexpected error occurred: {str(e)}\n\nPlease try again in a few moments."
         logger.error(f"Unexpected error in chat endpoint: {str(e)}")
         return jsonify({"error": error_msg}), 500
 
+@app.route('/cache/stats')
+def cache_stats():
+    stats = response_cache.stats() if response_cache is not None else {}
+    stats["enabled"] = response_cache is not None
+    stats["semantic"] = semantic_cache.stats() if semantic_cache is not None else {"enabled": False}
+    stats["single_flight"] = {
+        "generate": generation_flights.stats(),
+        "stream": stream_flights.stats()
+    }
+    return jsonify(stats)
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the response as NDJSON events while Ollama generates it"""
+    data = request.json or {}
+    user_message = data.get('message', '').strip()
+    client_ip = request.remote_addr
+    
+    if not user_message:
+        return jsonify({"error": "Please enter a message"}), 400
+        
+    limited = check_rate_limit(client_ip)
+    if limited:
+        return limited
+        
+    logger.info("Received streaming message", extra=log_fields(sampled=True, user_message=describe_text(user_message)))
+    model_keeper.record_activity()
+    enhanced_prompt, route = route_message(user_message)
+    session_id, session = session_store.get(data.get('session_id'))
+    conversational = continues_session(session, user_message, enhanced_prompt, route)
+    cached = not conversational and is_cached(enhanced_prompt, route)
+    similar_answer = None if conversational or cached else find_similar_answer(user_message, route)
+    details = {}
+    if conversational:
+        tokens = stream_single_response(
+            enhanced_prompt, payload=build_session_payload(session, enhanced_prompt, stream=True, route=route),
+            details=details
+        )
+    elif similar_answer is not None:
+        tokens = iter([similar_answer])
+    else:
+        tokens = stream_response_with_retry(enhanced_prompt, route=route)
+    
+    ticket = None
+    if not cached and similar_answer is None:
+        try:
+            priority, cost = request_class(enhanced_prompt, route)
+            ticket = admission_queue.enqueue(priority, client=client_ip, cost=cost)
+        except QueueFullError as e:
+            logger.warning(f"Request from {client_ip} not admitted: {e}")
+            return server_busy_response()
+            
+    request_id = g.request_id  # The generator runs after the request context is gone
+    
+    def generate():
+        formatter = StreamingCodeFormatter()
+        pieces = []
+        raw_tokens = []
+        started = time.perf_counter()
+        generating = None  # When the model started on the answer, for the route's latency
+        outcome = 'cancelled'  # Unless the stream ends one way or the other
+        try:
+            # Report the queue position until a generation slot frees up
+            while ticket is not None and not admission_queue.wait(ticket, QUEUE_POSITION_INTERVAL):
+                if ticket.wait_time > admission_queue.max_wait:
+                    admission_queue.record_timeout(ticket)
+                    logger.warning(f"Request from {client_ip} timed out in queue")
+                    yield json.dumps({"type": "error", "error": SERVER_BUSY_MESSAGE}) + "\n"
+                    return
+                yield json.dumps({"type": "queued", "position": admission_queue.position(ticket)}) + "\n"
+            if ticket is not None:
+                record_stage('queue', ticket.wait_time)
+                generating = time.perf_counter()
+                
+            for token in tokens:
+                raw_tokens.append(token)
+                text = formatter.feed(token)
+                if text:
+                    pieces.append(text)
+                    yield json.dumps({"type": "token", "text": text}) + "\n"
+            text = formatter.flush()
+            if text:
+                pieces.append(text)
+                yield json.dumps({"type": "token", "text": text}) + "\n"
+                
+            # The final event carries the complete answer, with heuristic code detection
+            # applied when the model did not use fences
+            response_text = ''.join(pieces)
+            session.record_turn(user_message, response_text, details.get('context'))
+            if not conversational and similar_answer is None:
+                remember_answer(user_message, ''.join(raw_tokens), route)
+            outcome = 'ok'
+            logger.info("Streamed response generated successfully", extra=log_fields(
+                sampled=True, request_id=request_id, route=route.name, response_chars=len(response_text)
+            ))
+            yield json.dumps({"type": "done", "response": format_code_response(response_text), "session_id": session_id}) + "\n"
+        except GenerationError as e:
+            outcome = 'error'
+            logger.error(f"Failed to stream response. Last error: {e}", extra=log_fields(request_id=request_id))
+            error_msg = OLLAMA_UNAVAILABLE_MESSAGE if str(e) == CIRCUIT_OPEN_ERROR else generation_error_message(e)
+            yield json.dumps({"type": "error", "error": error_msg}) + "\n"
+        except Exception as e:
+            outcome = 'error'
+            logger.error(f"Unexpected error in chat stream: {str(e)}", extra=log_fields(request_id=request_id))
+            yield json.dumps({"type": "error", "error": f"An unexpected error occurred: {str(e)}\n\nPlease try again in a few moments."}) + "\n"
+        finally:
+            record_stage('stream', time.perf_counter() - started)
+            if generating is not None:
+                record_route(route, time.perf_counter() - generating, outcome)
+            if ticket is not None:
+                admission_queue.release(ticket)
+                
+    response = Response(generate(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop reverse proxies from buffering the stream
+    })
+    if ticket is not None:
+        # Frees the slot even if the client disconnects before the stream starts
+        response.call_on_close(lambda: admission_queue.release(ticket))
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID', '')[:64] or secrets.token_hex(8)
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    http_requests.inc(endpoint=endpoint, status=response.status_code)
+    seconds = time.perf_counter() - g.request_started if 'request_started' in g else None
+    if seconds is not None:
+        http_request_seconds.observe(seconds, endpoint=endpoint)
+    timings = g.get('server_timing') or {}
+    if SERVER_TIMING and timings:
+        response.headers['Server-Timing'] = ', '.join(
+            f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items()
+        )
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    # Streams are still running here, so their duration is the time to the first byte
+    logger.info("Request completed", extra=log_fields(
+        sampled=response.status_code < 500, method=request.method, endpoint=endpoint, status=response.status_code,
+        duration_ms=round(seconds * 1000, 1) if seconds is not None else None,
+        stages_ms={stage: round(stage_time * 1000, 1) for stage, stage_time in timings.items()},
+        request_bytes=request.content_length, response_bytes=response.content_length
+    ))
+    return response
+
+# Set when the server begins a graceful shutdown, so load balancers stop sending traffic
+# while in-flight generations finish
+shutting_down = Event()
+
+def begin_shutdown():
+    shutting_down.set()
+    logger.info("Shutting down: finishing in-flight requests")
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 503 while shutting down, warming up the model, or when no Ollama server can take requests"""
+    model = model_keeper.stats()
+    if shutting_down.is_set():
+        status = "shutting_down"
+    elif not model["warmed_up"]:
+        status = "warming_up"
+    elif not ollama_pool.available():
+        status = "ollama_unavailable"
+    else:
+        status = "ready"
+    body = {"status": status, "models": model["models"], "loaded_on": model["loaded_on"]}
+    return jsonify(body), 200 if status == "ready" else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=prometheus.CONTENT_TYPE)
+
+@app.route('/queue/stats')
+def queue_stats():
+    return jsonify(admission_queue.stats())
+
+@app.route('/ollama/stats')
+def ollama_stats():
+    return jsonify({
+        "backends": ollama_pool.stats(),
+        "model": model_keeper.stats(),
+        "latency": latency_tracker.stats(),
+        "first_token_latency": first_token_tracker.stats(),
+        "retry_budget": retry_budget.stats(),
+        "cancellation": {
+            "disconnect_monitor": disconnect_monitor.stats() if disconnect_monitor is not None else None,
+            "generations_cancelled": generations_cancelled.value(),
+            "gpu_seconds_saved": round(gpu_seconds_saved.value(), 2)
+        }
+    })
+
+@app.route('/routing/stats')
+def routing_stats():
+    return jsonify(model_router.stats())
+
+@app.route('/sessions/stats')
+def session_stats():
+    return jsonify(session_store.stats())
+
+def answer_batch_prompt(prompt, job_id):
+    """Answer one prompt of a batch job like /chat would, queued behind interactive requests"""
+    enhanced_prompt, route = route_message(prompt)
+    if is_cached(enhanced_prompt, route):
+        response_text, last_error = generate_response_with_retry(enhanced_prompt, route=route)
+    else:
+        _, cost = request_class(enhanced_prompt, route)
+        try:
+            # Each job is its own queue client, so a big batch can't crowd out other jobs
+            with admission_queue.slot(PRIORITY_BULK, client=f"batch:{job_id}", cost=cost):
+                started = time.perf_counter()
+                response_text, last_error = generate_response_with_retry(enhanced_prompt, route=route)
+                record_route(route, time.perf_counter() - started, 'ok' if response_text else 'error')
+        except (QueueFullError, QueueTimeoutError) as e:
+            return None, str(e)
+    if not response_text:
+        return None, str(last_error)
+    return format_code_response(response_text), None
+
+# Background jobs answering lists of prompts, configured by BATCH_*
+batch_manager = create_batch_manager(answer_batch_prompt)
+BATCH_KEEPALIVE_INTERVAL = 15.0  # Seconds between keep-alive lines while following a job
+
+def batch_job_urls(job_id):
+    return {
+        "status_url": url_for('batch_status', job_id=job_id),
+        "results_url": url_for('batch_results', job_id=job_id)
+    }
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    data = request.json or {}
+    prompts = data.get('prompts')
+    if not isinstance(prompts, list):
+        return jsonify({"error": "Send the prompts as a JSON list: {\"prompts\": [...]}"}), 400
+    limited = check_rate_limit(request.remote_addr)
+    if limited:
+        return limited
+    try:
+        job_id = batch_manager.create(prompts)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    logger.info(f"Batch {job_id} of {len(prompts)} prompts from {request.remote_addr}")
+    return jsonify({"job_id": job_id, "total": len(prompts), **batch_job_urls(job_id)}), 202
+
+@app.route('/batch/stats')
+def batch_stats():
+    return jsonify(batch_manager.stats())
+
+@app.route('/batch/<job_id>', methods=['GET', 'DELETE'])
+def batch_status(job_id):
+    """Poll a job (with its finished results unless ?results=0), or cancel it with DELETE"""
+    try:
+        if request.method == 'DELETE':
+            batch_manager.cancel(job_id)
+        include_results = request.args.get('results', '1').lower() not in ('0', 'false', 'no')
+        return jsonify(batch_manager.status(job_id, include_results))
+    except JobNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.route('/batch/<job_id>/resume', methods=['POST'])
+def resume_batch(job_id):
+    """Run a job's unanswered and failed prompts again"""
+    try:
+        queued = batch_manager.resume(job_id)
+    except JobNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"job_id": job_id, "queued": queued, **batch_job_urls(job_id)}), 202
+
+@app.route('/batch/<job_id>/results')
+def batch_results(job_id):
+    """Stream a job's results as NDJSON as they finish, ending with the job summary"""
+    try:
+        batch_manager.status(job_id, include_results=False)
+    except JobNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+    def generate():
+        for event in batch_manager.follow(job_id, BATCH_KEEPALIVE_INTERVAL):
+            if event is None:
+                yield json.dumps({"type": "waiting"}) + "\n"
+            elif "job_id" in event:
+                yield json.dumps({"type": "done", **event}) + "\n"
+            else:
+                yield json.dumps({"type": "result", **event}) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
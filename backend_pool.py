@@ -0,0 +1,187 @@
+"""Spread generations across several Ollama servers.
+
+OLLAMA_API_URL may list several comma-separated servers. Each request goes
+to the backend with the fewest requests in flight (or, with the `latency`
+strategy, the lowest in-flight count weighted by recent latency). Backends
+without the requested model loaded count as `cold_penalty` requests busier,
+so warm servers are preferred and a cold load only happens once they are
+saturated. Every backend has its own circuit breaker, and a background
+health check takes unreachable servers out of rotation until they recover;
+requests already running on them are left to finish.
+"""
+import logging
+import os
+from threading import Lock, Thread, Event
+from contextlib import contextmanager
+
+import ollama_client
+from resilience import create_circuit_breaker, OPEN
+
+logger = logging.getLogger(__name__)
+
+LEAST_OUTSTANDING = 'least_outstanding'
+LATENCY_WEIGHTED = 'latency'
+STRATEGIES = (LEAST_OUTSTANDING, LATENCY_WEIGHTED)
+
+class NoBackendAvailableError(Exception):
+    """Raised when every backend is unhealthy or has an open circuit"""
+
+class Backend:
+    def __init__(self, url, breaker):
+        self.url = url
+        self.breaker = breaker
+        self.outstanding = 0
+        self.healthy = True
+        self.loaded_models = set()
+        self.latency = None  # Moving average of successful request durations, in seconds
+        self.requests = 0
+        self.failures = 0
+
+    def has_model(self, model):
+        return any(ollama_client.model_matches(name, model) for name in self.loaded_models)
+
+    def available(self):
+        """Whether new requests may be routed here; does not claim a half-open probe"""
+        return self.healthy and self.breaker.state != OPEN
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "outstanding": self.outstanding,
+            "loaded_models": sorted(self.loaded_models),
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+class BackendPool:
+    def __init__(self, urls, strategy=LEAST_OUTSTANDING, health_interval=10.0, cold_penalty=2,
+                 latency_smoothing=0.2, breaker_factory=create_circuit_breaker):
+        if not urls:
+            raise ValueError("At least one Ollama backend is required")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.strategy = strategy
+        self.health_interval = health_interval
+        self.cold_penalty = cold_penalty
+        self.latency_smoothing = latency_smoothing
+        # A lone backend keeps the breaker name used before pooling, so shared state carries over
+        self.backends = [
+            Backend(url, breaker_factory('ollama' if len(urls) == 1 else f'ollama:{url}'))
+            for url in urls
+        ]
+        self._lock = Lock()
+        self._stop = Event()
+        self._health_thread = None
+
+    def available(self):
+        """Whether any backend can take requests right now"""
+        return any(backend.available() for backend in self.backends)
+
+    @property
+    def reset_timeout(self):
+        return min(backend.breaker.reset_timeout for backend in self.backends)
+
+    def _score(self, backend, model):
+        load = backend.outstanding
+        if model and not backend.has_model(model):
+            load += self.cold_penalty
+        if self.strategy == LATENCY_WEIGHTED:
+            # Unmeasured backends count as fast so they get sampled
+            return ((load + 1) * (backend.latency or 0.0), load)
+        return (load, backend.latency or 0.0)
+
+    def acquire(self, model=None):
+        """Pick a backend for a request and count it as in flight; raises NoBackendAvailableError"""
+        self.start_health_checks()
+        with self._lock:
+            candidates = sorted(
+                (backend for backend in self.backends if backend.available()),
+                key=lambda backend: self._score(backend, model)
+            )
+            for backend in candidates:
+                # allow() claims the single probe of a half-open breaker, so only ask the chosen one
+                if backend.breaker.allow():
+                    backend.outstanding += 1
+                    backend.requests += 1
+                    return backend
+        raise NoBackendAvailableError("No healthy Ollama backend available")
+
+    def release(self, backend):
+        with self._lock:
+            backend.outstanding -= 1
+
+    @contextmanager
+    def backend(self, model=None):
+        backend = self.acquire(model)
+        try:
+            yield backend
+        finally:
+            self.release(backend)
+
+    def record_result(self, backend, status_code=None, latency=None):
+        """Feed a request outcome to the backend's breaker; status_code None means it never answered"""
+        if status_code is not None and status_code < 500:
+            backend.breaker.record_success()  # The server is up even if it rejected this request
+            if status_code == 200 and latency is not None:
+                self.record_latency(backend, latency)
+        else:
+            backend.breaker.record_failure()
+            with self._lock:
+                backend.failures += 1
+
+    def record_latency(self, backend, latency):
+        """Fold a response time into the backend's moving average used for routing"""
+        with self._lock:
+            if backend.latency is None:
+                backend.latency = latency
+            else:
+                backend.latency += self.latency_smoothing * (latency - backend.latency)
+
+    def check_health(self):
+        """Probe every backend once, refreshing its health and the models it has loaded"""
+        for backend in self.backends:
+            try:
+                models = ollama_client.get_loaded_models(backend.url, timeout=min(5.0, self.health_interval or 5.0))
+            except Exception as e:
+                if backend.healthy:
+                    logger.warning(f"Ollama backend {backend.url} failed its health check, draining it: {e}")
+                backend.healthy = False
+                continue
+            if not backend.healthy:
+                logger.info(f"Ollama backend {backend.url} is healthy again")
+            backend.healthy = True
+            backend.loaded_models = set(models)
+
+    def start_health_checks(self):
+        """Start the background health checker; not needed when there is a single backend"""
+        if self._health_thread is not None or len(self.backends) < 2 or not self.health_interval:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = Thread(target=self._health_loop, name='ollama-health', daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self):
+        while not self._stop.is_set():
+            self.check_health()
+            self._stop.wait(self.health_interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            backends = [backend.stats() for backend in self.backends]
+        return {"strategy": self.strategy, "backends": backends}
+
+def create_backend_pool():
+    """Build the pool from OLLAMA_API_URL and the OLLAMA_ROUTING/HEALTH_INTERVAL/COLD_PENALTY settings"""
+    return BackendPool(
+        ollama_client.OLLAMA_API_URLS,
+        strategy=os.environ.get('OLLAMA_ROUTING', LEAST_OUTSTANDING).lower(),
+        health_interval=float(os.environ.get('OLLAMA_HEALTH_INTERVAL', 10)),
+        cold_penalty=int(os.environ.get('OLLAMA_COLD_PENALTY', 2))
+    )
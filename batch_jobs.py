@@ -0,0 +1,293 @@
+"""Batch jobs: answer a list of prompts in the background.
+
+A job is created from a list of prompts and gets an id straight away. Its
+prompts are answered by a shared pool of `max_parallel` workers, so several
+batches together never put more than that many requests on the model
+server, and every result is written to a sqlite database as soon as it is
+known. Clients poll the job or follow its results as they arrive.
+
+Because results are stored per prompt, a job that was cancelled, hit
+errors or was interrupted by a restart (with a file database) can be
+resumed: only the prompts without an answer are run again.
+
+Several processes, such as gunicorn workers, can share a file database:
+each item records the process answering it, so any of them can report on
+and follow a job another one is running, and none starts its prompts twice.
+"""
+import os
+import time
+import sqlite3
+import secrets
+import logging
+from threading import Lock, Condition
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+REMOTE_POLL_INTERVAL = 1.0  # Seconds between checks on a job another process is running
+
+def _running_elsewhere(pid):
+    """Whether pid is another live process on this host; a dead owner's items were interrupted"""
+    if not pid or pid == os.getpid() or os.name != 'posix':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobNotFoundError(Exception):
+    """Raised for an unknown job id"""
+
+class BatchManager:
+    def __init__(self, answer, path=':memory:', max_parallel=2, max_prompts=500, retention=86400):
+        """answer(prompt, job_id) returns (response text, error message); one of them is None"""
+        self.answer = answer
+        self.path = path
+        self.max_parallel = max_parallel
+        self.max_prompts = max_prompts
+        self.retention = retention
+        self._lock = Lock()
+        self._changed = Condition(self._lock)  # Notified whenever an item finishes
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='batch')
+        self._submitted = set()  # (job id, index) queued or running in this process
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._conn:
+            if path != ':memory:':
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS batch_jobs ("
+                "id TEXT PRIMARY KEY, created_at REAL NOT NULL, cancelled INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS batch_items ("
+                "job_id TEXT NOT NULL, idx INTEGER NOT NULL, prompt TEXT NOT NULL, status TEXT NOT NULL, "
+                "response TEXT, error TEXT, finished_at REAL, owner INTEGER, PRIMARY KEY (job_id, idx))"
+            )
+            if 'owner' not in {row[1] for row in self._conn.execute("PRAGMA table_info(batch_items)")}:
+                self._conn.execute("ALTER TABLE batch_items ADD COLUMN owner INTEGER")
+
+    def create(self, prompts):
+        """Store a new job and start answering it; returns the job id"""
+        if not prompts:
+            raise ValueError("A batch needs at least one prompt")
+        if len(prompts) > self.max_prompts:
+            raise ValueError(f"A batch can have at most {self.max_prompts} prompts")
+        if not all(isinstance(prompt, str) and prompt.strip() for prompt in prompts):
+            raise ValueError("Every prompt must be a non-empty string")
+        job_id = secrets.token_urlsafe(12)
+        with self._lock, self._conn:
+            self._purge_expired()
+            self._conn.execute("INSERT INTO batch_jobs (id, created_at) VALUES (?, ?)", (job_id, time.time()))
+            self._conn.executemany(
+                "INSERT INTO batch_items (job_id, idx, prompt, status) VALUES (?, ?, ?, ?)",
+                [(job_id, index, prompt.strip(), PENDING) for index, prompt in enumerate(prompts)]
+            )
+        self._submit_unfinished(job_id)
+        return job_id
+
+    def resume(self, job_id):
+        """Run the job's unanswered and failed prompts again; returns how many were queued"""
+        with self._lock, self._conn:
+            self._require(job_id)
+            self._conn.execute("UPDATE batch_jobs SET cancelled = 0 WHERE id = ?", (job_id,))
+        return self._submit_unfinished(job_id)
+
+    def cancel(self, job_id):
+        """Stop starting new prompts of the job; answers already being generated still complete"""
+        with self._lock, self._conn:
+            self._require(job_id)
+            self._conn.execute("UPDATE batch_jobs SET cancelled = 1 WHERE id = ?", (job_id,))
+            self._changed.notify_all()
+
+    def _submit_unfinished(self, job_id):
+        with self._lock:
+            # Items left RUNNING by an earlier process will never finish; run them again too
+            rows = self._conn.execute(
+                "SELECT idx, prompt, status, owner FROM batch_items WHERE job_id = ? AND status != ? ORDER BY idx",
+                (job_id, DONE)
+            ).fetchall()
+            rows = [
+                (index, prompt) for index, prompt, status, owner in rows
+                if (job_id, index) not in self._submitted
+                and not (status in (PENDING, RUNNING) and _running_elsewhere(owner))
+            ]
+            self._submitted.update((job_id, index) for index, _ in rows)
+            if rows:
+                self._conn.execute(
+                    f"UPDATE batch_items SET status = ?, error = NULL, owner = ? WHERE job_id = ? AND status != ? "
+                    f"AND idx IN ({','.join('?' * len(rows))})",
+                    [PENDING, os.getpid(), job_id, DONE] + [index for index, _ in rows]
+                )
+                self._conn.commit()
+                self._changed.notify_all()
+        for index, prompt in rows:
+            self._executor.submit(self._run_item, job_id, index, prompt)
+        return len(rows)
+
+    def _run_item(self, job_id, index, prompt):
+        try:
+            with self._lock:
+                cancelled = self._conn.execute("SELECT cancelled FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+                if not cancelled or cancelled[0]:
+                    return  # Left PENDING, so resume picks it up
+                self._set_item(job_id, index, RUNNING)
+            try:
+                response, error = self.answer(prompt, job_id)
+            except Exception as e:
+                logger.error(f"Batch {job_id} prompt {index} failed: {e}")
+                response, error = None, str(e)
+            with self._lock:
+                if response:
+                    self._set_item(job_id, index, DONE, response=response)
+                else:
+                    self._set_item(job_id, index, FAILED, error=error or "No response generated")
+        finally:
+            with self._lock:
+                self._submitted.discard((job_id, index))
+                self._changed.notify_all()
+
+    def _set_item(self, job_id, index, status, response=None, error=None):
+        finished_at = time.time() if status in (DONE, FAILED) else None
+        with self._conn:
+            self._conn.execute(
+                "UPDATE batch_items SET status = ?, response = ?, error = ?, finished_at = ? "
+                "WHERE job_id = ? AND idx = ?",
+                (status, response, error, finished_at, job_id, index)
+            )
+
+    def _require(self, job_id):
+        row = self._conn.execute("SELECT created_at, cancelled FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFoundError(f"Unknown batch job: {job_id}")
+        return row
+
+    def _active(self, job_id):
+        """Whether this process or another live one is still answering the job"""
+        if any(submitted_job == job_id for submitted_job, _ in self._submitted):
+            return True
+        owners = self._conn.execute(
+            "SELECT DISTINCT owner FROM batch_items WHERE job_id = ? AND status IN (?, ?)", (job_id, PENDING, RUNNING)
+        ).fetchall()
+        return any(_running_elsewhere(owner) for owner, in owners)
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.retention
+        expired = [row[0] for row in self._conn.execute("SELECT id FROM batch_jobs WHERE created_at < ?", (cutoff,))]
+        for job_id in expired:
+            if not self._active(job_id):
+                self._conn.execute("DELETE FROM batch_items WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM batch_jobs WHERE id = ?", (job_id,))
+
+    def _summary(self, job_id):
+        created_at, cancelled = self._require(job_id)
+        counts = dict(self._conn.execute(
+            "SELECT status, COUNT(*) FROM batch_items WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        total = sum(counts.values())
+        unfinished = counts.get(PENDING, 0) + counts.get(RUNNING, 0)
+        if self._active(job_id):
+            status = RUNNING
+        elif unfinished:
+            status = CANCELLED if cancelled else 'interrupted'  # Either way, resume finishes it
+        elif counts.get(FAILED):
+            status = 'completed_with_errors'
+        else:
+            status = 'completed'
+        return {
+            "job_id": job_id,
+            "status": status,
+            "created_at": created_at,
+            "total": total,
+            "done": counts.get(DONE, 0),
+            "failed": counts.get(FAILED, 0),
+            "pending": unfinished
+        }
+
+    def status(self, job_id, include_results=True):
+        """The job summary, plus every finished item when include_results is set"""
+        with self._lock:
+            summary = self._summary(job_id)
+            if include_results:
+                summary["results"] = [
+                    self._item(row) for row in self._conn.execute(
+                        "SELECT idx, prompt, status, response, error FROM batch_items "
+                        "WHERE job_id = ? AND status IN (?, ?) ORDER BY idx", (job_id, DONE, FAILED)
+                    )
+                ]
+            return summary
+
+    @staticmethod
+    def _item(row):
+        index, prompt, status, response, error = row
+        item = {"index": index, "prompt": prompt, "status": status}
+        if status == DONE:
+            item["response"] = response
+        else:
+            item["error"] = error
+        return item
+
+    def follow(self, job_id, poll_interval=15.0):
+        """Yield finished items as they complete (earlier ones first), then the final summary.
+
+        Yields None every poll_interval seconds without news, so a caller
+        streaming over HTTP can send a keep-alive line.
+        """
+        seen = set()
+        quiet_since = time.monotonic()
+        while True:
+            with self._lock:
+                summary = self._summary(job_id)
+                rows = self._conn.execute(
+                    "SELECT idx, prompt, status, response, error, finished_at FROM batch_items "
+                    "WHERE job_id = ? AND status IN (?, ?) ORDER BY finished_at, idx", (job_id, DONE, FAILED)
+                ).fetchall()
+                # A resumed item that failed earlier may finish again; key on the finish time too
+                fresh = [row for row in rows if (row[0], row[5]) not in seen]
+                seen.update((row[0], row[5]) for row in fresh)
+                finished = summary["status"] != RUNNING
+                if not fresh and not finished:
+                    # Only this process's items notify; another process's progress has to be polled for
+                    local = any(submitted_job == job_id for submitted_job, _ in self._submitted)
+                    self._changed.wait(poll_interval if local else min(poll_interval, REMOTE_POLL_INTERVAL))
+            for row in fresh:
+                yield self._item(row[:5])
+            if finished and not fresh:
+                yield summary
+                return
+            if fresh:
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= poll_interval:
+                quiet_since = time.monotonic()
+                yield None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM batch_items GROUP BY status").fetchall())
+            return {
+                "jobs": self._conn.execute("SELECT COUNT(*) FROM batch_jobs").fetchone()[0],
+                "items": counts,
+                "in_progress": len(self._submitted),
+                "max_parallel": self.max_parallel,
+                "max_prompts": self.max_prompts
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def create_batch_manager(answer):
+    """Build the manager configured by the BATCH_* environment variables"""
+    return BatchManager(
+        answer,
+        path=os.environ.get('BATCH_STORE_PATH', ':memory:'),
+        max_parallel=int(os.environ.get('BATCH_CONCURRENCY', 2)),
+        max_prompts=int(os.environ.get('BATCH_MAX_PROMPTS', 500)),
+        retention=float(os.environ.get('BATCH_RETENTION', 86400))
+    )
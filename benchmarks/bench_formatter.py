@@ -0,0 +1,103 @@
+"""Compare the previous format_code_response with the single-pass code_formatter.
+
+    python benchmarks/bench_formatter.py --blocks 200 --repeat 20
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from code_formatter import format_code_response, StreamingCodeFormatter
+
+def legacy_format_code_response(response):
+    """The implementation previously duplicated in app.py and api/index.py"""
+    if not response:
+        return "I apologize, but I couldn't generate a response. Please try again with a simpler question."
+    if '[CODE]' in response:
+        return response
+    code_patterns = {
+        'html': r'```(?:html)?\n(.*?)```',
+        'css': r'```(?:css)?\n(.*?)```',
+        'python': r'```(?:python)?\n(.*?)```'
+    }
+    formatted_response = response
+    for lang, pattern in code_patterns.items():
+        matches = re.findall(pattern, response, re.DOTALL)
+        if matches:
+            for code_block in matches:
+                formatted_response = formatted_response.replace(
+                    f'```{lang}\n{code_block}```',
+                    f'[CODE]{code_block.strip()}[/CODE]'
+                ).replace(
+                    f'```\n{code_block}```',
+                    f'[CODE]{code_block.strip()}[/CODE]'
+                )
+    if not '[CODE]' in formatted_response:
+        code_indicators = {
+            'html': ['<html', '<body', '<div', '<p', '<script', '<style'],
+            'css': ['{', 'body {', '.class', '#id', '@media'],
+            'python': ['def ', 'class ', 'print(', 'return ', 'import ']
+        }
+        for lang, indicators in code_indicators.items():
+            if any(indicator in formatted_response for indicator in indicators):
+                lines = formatted_response.split('\n')
+                code_lines = []
+                in_code = False
+                for line in lines:
+                    if any(indicator in line for indicator in indicators):
+                        in_code = True
+                    if in_code:
+                        code_lines.append(line)
+                if code_lines:
+                    code_block = '\n'.join(code_lines)
+                    formatted_response = f'Here\'s the {lang.upper()} code:\n\n[CODE]{code_block.strip()}[/CODE]'
+                    break
+    return formatted_response
+
+def build_fenced_response(blocks):
+    parts = []
+    for i in range(blocks):
+        lang = ('python', 'html', 'css', '')[i % 4]
+        parts.append(f"Step {i}: here is the next part of the solution.\n")
+        parts.append(f"```{lang}\n" + f"def step_{i}(value):\n    return value * {i}\n" * 5 + "```\n")
+    return ''.join(parts)
+
+def build_unfenced_response(lines):
+    prose = [f"This paragraph explains idea number {i} in plain words." for i in range(lines)]
+    return '\n'.join(prose + ["def solution(n):", "    return n + 1"])
+
+def timed(fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat * 1000
+
+def stream_format(text, piece=8):
+    formatter = StreamingCodeFormatter()
+    out = [formatter.feed(text[i:i + piece]) for i in range(0, len(text), piece)]
+    out.append(formatter.flush())
+    return ''.join(out)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blocks', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    cases = {
+        f'{args.blocks} fenced blocks': build_fenced_response(args.blocks),
+        f'{args.blocks * 20} lines, no fences': build_unfenced_response(args.blocks * 20),
+    }
+    for name, text in cases.items():
+        legacy = timed(legacy_format_code_response, text, args.repeat)
+        single_pass = timed(format_code_response, text, args.repeat)
+        streaming = timed(stream_format, text, args.repeat)
+        print(f"{name} ({len(text) / 1024:.0f} KiB)")
+        print(f"  legacy format_code_response            {legacy:9.2f} ms")
+        print(f"  code_formatter (single pass)           {single_pass:9.2f} ms  ({legacy / single_pass:.1f}x)")
+        print(f"  StreamingCodeFormatter (8-char pieces) {streaming:9.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Requests/sec of bare requests.post vs the pooled and async Ollama clients.
+
+Runs against an in-process stub Ollama server:
+
+    python benchmarks/bench_ollama_client.py --requests 2000 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ollama_client
+from stub_ollama import start_stub_server
+
+PAYLOAD = {"model": "codellama", "prompt": "write factorial in python", "stream": False}
+
+def run_threaded(call, total, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for response in pool.map(lambda _: call(), range(total)):
+            assert response.status_code == 200
+    return total / (time.perf_counter() - start)
+
+async def run_async(base_url, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with ollama_client.AsyncOllamaClient(base_url, pool_size=concurrency) as client:
+        async def one():
+            async with semaphore:
+                await client.generate(PAYLOAD)
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return total / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server()
+    url = f"{base_url}/api/generate"
+    ollama_client.OLLAMA_API_URL = base_url
+    ollama_client.POOL_SIZE = args.concurrency
+
+    results = {
+        'requests.post (new connection per call)': run_threaded(
+            lambda: requests.post(url, json=PAYLOAD, timeout=30), args.requests, args.concurrency),
+        'ollama_client.post_generate (pooled)': run_threaded(
+            lambda: ollama_client.post_generate(PAYLOAD, timeout=30), args.requests, args.concurrency),
+    }
+    if ollama_client.aiohttp is not None:
+        results['AsyncOllamaClient (single thread)'] = asyncio.run(
+            run_async(base_url, args.requests, args.concurrency))
+    else:
+        print("aiohttp not installed, skipping async client")
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}")
+    for name, rate in results.items():
+        print(f"  {name:<45} {rate:8.0f} req/s")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Prompt processing per request with the instructions inline vs as the system prompt.
+
+`inline` sends each message the old way, followed by the template's
+instructions in the prompt; `system` sends the instructions as the system
+prompt, ahead of the message, so Ollama can reuse their evaluated prefix.
+Reports the mean prompt_eval_count and prompt_eval_duration Ollama returns.
+Runs against an in-process stub that models prefix reuse, or a real server:
+
+    python benchmarks/bench_prompt_templates.py --prompt-eval-rate 400
+    python benchmarks/bench_prompt_templates.py --url http://localhost:11434
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ollama_client
+from model_routing import KeywordClassifier
+from prompt_templates import template_for
+from stub_ollama import start_stub_server
+
+MESSAGES = [
+    "write a python function to reverse a list",
+    "what is the difference between a process and a thread?",
+    "how do I read a csv file in python",
+    "explain big O notation",
+    "sort a dict by value in python",
+    "what does REST mean?",
+    "write a regex that matches email addresses",
+    "why is my recursion hitting the maximum depth",
+    "how do I center a div with css",
+    "what is a race condition?"
+]
+
+def build_payload(message, layout, model):
+    template = template_for(KeywordClassifier()(message))
+    payload = {"model": model, "stream": False, "num_predict": 1, "num_ctx": 512}
+    if layout == 'inline':
+        payload["prompt"] = f"{template.render(message)}\n\n{template.system}"
+        return payload
+    payload["prompt"] = template.render(message)
+    return template.apply(payload)
+
+def run_layout(layout, model, rounds):
+    counts = []
+    durations = []
+    # Prime the cache the way a running server's earlier traffic would
+    ollama_client.post_generate(build_payload("hello", layout, model), timeout=300).raise_for_status()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in MESSAGES:
+            response = ollama_client.post_generate(build_payload(message, layout, model), timeout=300)
+            response.raise_for_status()
+            result = response.json()
+            counts.append(result.get('prompt_eval_count') or 0)
+            durations.append((result.get('prompt_eval_duration') or 0) / 1e6)
+    return {
+        "requests": len(counts),
+        "prompt_eval_count": sum(counts) / len(counts),
+        "prompt_eval_ms": sum(durations) / len(durations),
+        "seconds": time.perf_counter() - start
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Ollama server to measure instead of the stub')
+    parser.add_argument('--model', default='codellama')
+    parser.add_argument('--rounds', type=int, default=3, help='Times each message is sent per layout')
+    parser.add_argument('--prompt-eval-rate', type=float, default=400.0,
+                        help="The stub's prompt tokens evaluated per second")
+    args = parser.parse_args()
+
+    if args.url:
+        base_url = args.url
+    else:
+        _, base_url = start_stub_server(prompt_eval_rate=args.prompt_eval_rate)
+    ollama_client.OLLAMA_API_URL = base_url
+
+    results = {layout: run_layout(layout, args.model, args.rounds) for layout in ('inline', 'system')}
+    for layout, result in results.items():
+        print(f"{layout:7} {result['prompt_eval_count']:7.1f} prompt tokens/request  "
+              f"{result['prompt_eval_ms']:8.1f} ms prompt eval/request  "
+              f"({result['requests']} requests in {result['seconds']:.2f}s)")
+    inline, system = results['inline']['prompt_eval_ms'], results['system']['prompt_eval_ms']
+    if inline:
+        print(f"system prompts cut prompt evaluation by {(1 - system / inline) * 100:.0f}%")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Load generator for the /chat endpoints, backed by the stub Ollama server.
+
+Serves app.py (or api/index.py) in-process against a stub Ollama, sends
+requests at a fixed concurrency and reports requests/sec plus p50/p95/p99
+latency and time to first token. Each run is appended to a results file
+together with the current commit, and --compare prints the change against
+the last run with the same settings from another commit:
+
+    python benchmarks/load_test.py --requests 500 --concurrency 16 --latency 0.2 --token-rate 50 --stream
+    python benchmarks/load_test.py --target api --requests 500 --concurrency 16 --compare
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --requests 200   # an already running server
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from stub_ollama import start_stub_server, add_stub_arguments, stub_options
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'load_test.jsonl')
+
+def load_target_app(target, ollama_url):
+    """Import app.py or api/index.py configured to use the stub, returning its Flask app"""
+    os.environ['OLLAMA_API_URL'] = ollama_url
+    # Measure the model path, not the per-client limiter every request here would trip
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'none')
+    if target == 'app':
+        import app as module
+    else:
+        spec = importlib.util.spec_from_file_location('api_index', os.path.join(ROOT, 'api', 'index.py'))
+        module = sys.modules['api_index'] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    # Per-request INFO lines would skew the numbers
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    return module.app
+
+def serve_in_background(flask_app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def make_prompt(index, distinct):
+    # Distinct prompts keep the response cache from answering everything
+    return f"Write a python function that solves exercise {index % distinct if distinct else index}"
+
+def send_request(session, base_url, message, stream):
+    """Return (status, latency, time to first token); TTFT equals latency without streaming"""
+    started = time.perf_counter()
+    if not stream:
+        response = session.post(f"{base_url}/chat", json={"message": message})
+        response.content
+        latency = time.perf_counter() - started
+        return response.status_code, latency, latency
+
+    first_token = None
+    status = None
+    with session.post(f"{base_url}/chat/stream", json={"message": message}, stream=True) as response:
+        status = response.status_code
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get('type') == 'token' and first_token is None:
+                first_token = time.perf_counter() - started
+            elif event.get('type') == 'error':
+                status = 'error'
+    latency = time.perf_counter() - started
+    return status, latency, first_token if first_token is not None else latency
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    def at(percentile):
+        # Nearest-rank percentile
+        return values[max(0, min(len(values) - 1, int(round(percentile / 100 * len(values))) - 1))]
+    return {
+        "p50": round(at(50), 4),
+        "p95": round(at(95), 4),
+        "p99": round(at(99), 4),
+        "mean": round(sum(values) / len(values), 4),
+        "max": round(values[-1], 4)
+    }
+
+def run_load(base_url, total, concurrency, stream, distinct, warmup):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    for index in range(warmup):
+        send_request(session, base_url, f"warm-up request {index}", stream)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda index: send_request(session, base_url, make_prompt(index, distinct), stream),
+            range(total)
+        ))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    succeeded = [(latency, ttft) for status, latency, ttft in results if status == 200]
+    return {
+        "requests": total,
+        "errors": total - len(succeeded),
+        "statuses": statuses,
+        "duration": round(elapsed, 3),
+        "rps": round(total / elapsed, 2),
+        "latency": percentiles([latency for latency, _ in succeeded]),
+        "ttft": percentiles([ttft for _, ttft in succeeded])
+    }
+
+def current_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_result(path, record):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+def print_report(record):
+    print(f"{record['target']} {'/chat/stream' if record['config']['stream'] else '/chat'} "
+          f"at concurrency {record['config']['concurrency']} (commit {record['commit'] or 'unknown'}"
+          f"{', uncommitted changes' if record['dirty'] else ''})")
+    result = record['result']
+    print(f"  {result['rps']:.1f} req/s over {result['duration']}s, {result['errors']} errors {result['statuses']}")
+    for name in ('latency', 'ttft'):
+        stats = result[name]
+        if stats:
+            print(f"  {name:8} p50 {stats['p50'] * 1000:8.1f} ms  p95 {stats['p95'] * 1000:8.1f} ms  "
+                  f"p99 {stats['p99'] * 1000:8.1f} ms")
+
+def print_comparison(record, previous):
+    print(f"Compared with commit {previous['commit']} ({previous['timestamp']}):")
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+    print(f"  req/s {previous['result']['rps']:.1f} -> {record['result']['rps']:.1f} "
+          f"({change(record['result']['rps'], previous['result']['rps'])})")
+    for name in ('latency', 'ttft'):
+        for key in ('p50', 'p95', 'p99'):
+            new = record['result'][name].get(key)
+            old = previous['result'][name].get(key)
+            if new is not None and old is not None:
+                print(f"  {name} {key} {old * 1000:.1f} -> {new * 1000:.1f} ms ({change(new, old)})")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=('app', 'api'), default='app', help='Serve app.py or api/index.py')
+    parser.add_argument('--url', help='Load an already running server instead of starting one')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--stream', action='store_true', help='Use /chat/stream to measure time to first token')
+    parser.add_argument('--distinct-prompts', type=int, default=0,
+                        help='Cycle through this many prompts so some hit the cache (0 = all distinct)')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='JSON lines file runs are appended to')
+    parser.add_argument('--no-save', action='store_true')
+    parser.add_argument('--compare', action='store_true', help='Compare with the last matching run from another commit')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    if args.url:
+        base_url = args.url.rstrip('/')
+        target = args.url
+    else:
+        stub, ollama_url = start_stub_server(**stub_options(args))
+        server, base_url = serve_in_background(load_target_app(args.target, ollama_url))
+        target = args.target
+
+    commit, dirty = current_commit()
+    config = {
+        "target": target,
+        "concurrency": args.concurrency,
+        "stream": args.stream,
+        "distinct_prompts": args.distinct_prompts,
+        "stub": None if args.url else stub_options(args)
+    }
+    record = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+        "target": target,
+        "config": config,
+        "result": run_load(base_url, args.requests, args.concurrency, args.stream,
+                           args.distinct_prompts, args.warmup)
+    }
+    print_report(record)
+
+    if args.compare:
+        previous = [
+            run for run in load_results(args.results)
+            if run['config'] == config and run['commit'] != commit
+        ]
+        if previous:
+            print_comparison(record, previous[-1])
+        else:
+            print("No earlier run with the same settings from another commit to compare with")
+    if not args.no_save:
+        save_result(args.results, record)
+
+if __name__ == '__main__':
+    main()
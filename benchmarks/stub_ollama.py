@@ -0,0 +1,237 @@
+"""Minimal stand-in for the Ollama HTTP API, for benchmarks without a GPU.
+
+Run standalone with `python benchmarks/stub_ollama.py --port 11434` or start it
+in-process with `start_stub_server()`.
+
+The delay before the first token is drawn from a fixed, uniform or lognormal
+distribution; tokens then arrive at `token_rate` per second (0 sends them all
+at once), and `error_rate` of requests fail with `error_status`. With a
+`load_time`, the stub also mimics model loading: a request arriving while the
+model is unloaded waits that long first, and the model unloads once
+`keep_alive` (from the request, 5 minutes by default) passes without requests.
+With a `prompt_eval_rate`, prompt processing takes time too: like Ollama,
+the stub remembers the last few prompts (the system prompt first, then the
+prompt) and only evaluates the part after the longest prefix they share,
+at roughly four characters per token.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from collections import deque
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_RESPONSE = "Here's a factorial function:\n```python\ndef factorial(n):\n    return 1 if n <= 1 else n * factorial(n - 1)\n```\n"
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real server
+    disable_nagle_algorithm = True  # Go's net/http sets TCP_NODELAY too
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json(200, {"models": [{"name": f"{self.server.model}:latest"}]})
+        elif self.path == '/api/ps':
+            loaded = [] if self.server.load_time and not self.server.model_loaded() else [
+                {"name": f"{self.server.model}:latest", "model": f"{self.server.model}:latest"}
+            ]
+            self._send_json(200, {"models": loaded})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.path != '/api/generate':
+            self._send_json(404, {"error": "not found"})
+            return
+
+        server = self.server
+        load_duration = server.load_model(payload.get('keep_alive'))
+        if 'prompt' not in payload:
+            # A request without a prompt only loads the model, as in Ollama
+            self._send_json(200, {"model": payload.get('model'), "response": "", "done": True,
+                                  "done_reason": "load", "load_duration": int(load_duration * 1e9)})
+            return
+        first_token_delay = server.sample_latency()
+        prompt_eval_count, prompt_eval_delay = server.evaluate_prompt(payload)
+        if first_token_delay + prompt_eval_delay:
+            time.sleep(first_token_delay + prompt_eval_delay)
+        if server.error_rate and random.random() < server.error_rate:
+            self._send_json(server.error_status, {"error": "injected failure"})
+            return
+        text = server.response_text
+        tokens = text.split(' ')
+        token_delay = 1 / server.token_rate if server.token_rate else 0.0
+        # Fake token ids: the carried-over context plus roughly one per word of prompt and answer
+        context = list(payload.get('context') or []) + list(range(len(payload.get('prompt', '').split()) + len(text.split())))
+        final = {
+            "model": payload.get('model'), "done": True, "context": context,
+            # Timings in nanoseconds, as Ollama reports them
+            "load_duration": int(load_duration * 1e9),
+            "prompt_eval_count": prompt_eval_count,
+            "prompt_eval_duration": int((prompt_eval_delay if server.prompt_eval_rate else first_token_delay) * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int(len(tokens) * token_delay * 1e9)
+        }
+
+        if not payload.get('stream', True):
+            if token_delay:
+                time.sleep(len(tokens) * token_delay)
+            self._send_json(200, dict(final, response=text))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for index, token in enumerate(tokens):
+                if index and token_delay:
+                    time.sleep(token_delay)
+                self._write_chunk({"model": payload.get('model'), "response": token + ' ', "done": False})
+            self._write_chunk(dict(final, response=""))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped the generation, as Ollama sees when a request is cancelled
+            server.cancelled += 1
+            self.close_connection = True
+
+    def _write_chunk(self, body):
+        line = (json.dumps(body) + '\n').encode()
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        self.wfile.flush()
+
+def parse_duration(value, default=300.0):
+    """Seconds for a keep_alive value such as 300, '30s', '5m' or '1h' (negative means forever)"""
+    if value is None:
+        return default
+    text = str(value).strip()
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    for unit in ('ms', 's', 'm', 'h'):
+        if text.endswith(unit) and text[:-len(unit)].replace('.', '', 1).isdigit():
+            return float(text[:-len(unit)]) * units[unit]
+    seconds = float(text)
+    return float('inf') if seconds < 0 else seconds
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Load tests open many connections at once
+    loaded_until = 0.0
+    loads = 0
+    cancelled = 0
+
+    def model_loaded(self):
+        return time.monotonic() < self.loaded_until
+
+    def load_model(self, keep_alive):
+        """Wait out the load time if the model is unloaded; returns the seconds spent loading"""
+        load_duration = 0.0
+        if self.load_time and not self.model_loaded():
+            time.sleep(self.load_time)
+            load_duration = self.load_time
+            self.loads += 1
+        self.loaded_until = time.monotonic() + parse_duration(keep_alive)
+        return load_duration
+
+    def evaluate_prompt(self, payload):
+        """(tokens evaluated, seconds taken) for the prompt, reusing the longest cached prefix"""
+        text = payload.get('prompt', '')
+        if payload.get('system'):
+            text = f"{payload['system']}\n\n{text}"
+        if not self.prompt_eval_rate:
+            return len(payload.get('prompt', '').split()), 0.0
+        with self._prompt_lock:
+            reused = max((len(os.path.commonprefix([text, cached])) for cached in self.prompt_cache), default=0)
+            self.prompt_cache.append(text)
+        evaluated = math.ceil((len(text) - reused) / 4)
+        return evaluated, evaluated / self.prompt_eval_rate
+
+    def sample_latency(self):
+        """Seconds to wait before the first token, drawn from the configured distribution"""
+        if self.latency_distribution == 'uniform':
+            return random.uniform(self.latency, self.latency_max)
+        if self.latency_distribution == 'lognormal':
+            # latency is the median, as with a real model's skewed response times
+            return self.latency and random.lognormvariate(math.log(self.latency), self.latency_sigma)
+        return self.latency
+
+def make_stub_server(host='127.0.0.1', port=0, latency=0.0, response_text=DEFAULT_RESPONSE, model='codellama',
+                     latency_distribution='fixed', latency_max=None, latency_sigma=0.5,
+                     token_rate=0.0, error_rate=0.0, error_status=500, load_time=0.0,
+                     prompt_eval_rate=0.0, prompt_cache_slots=4):
+    if latency_distribution not in ('fixed', 'uniform', 'lognormal'):
+        raise ValueError(f"Unknown latency distribution: {latency_distribution}")
+    server = StubOllamaServer((host, port), StubOllamaHandler)
+    server.latency = latency
+    server.latency_distribution = latency_distribution
+    server.latency_max = latency if latency_max is None else latency_max
+    server.latency_sigma = latency_sigma
+    server.token_rate = token_rate
+    server.error_rate = error_rate
+    server.error_status = error_status
+    server.load_time = load_time
+    server.prompt_eval_rate = prompt_eval_rate
+    server.prompt_cache = deque(maxlen=prompt_cache_slots)
+    server._prompt_lock = Lock()
+    server.response_text = response_text
+    server.model = model
+    return server
+
+def add_stub_arguments(parser):
+    """Stub options shared by this script and the load generator"""
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds before the first token (the median for lognormal, the minimum for uniform)')
+    parser.add_argument('--latency-distribution', choices=('fixed', 'uniform', 'lognormal'), default='fixed')
+    parser.add_argument('--latency-max', type=float, help='Upper bound for the uniform distribution')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Spread of the lognormal distribution')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='Tokens per second after the first (0 = instant)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of generations that fail')
+    parser.add_argument('--error-status', type=int, default=500, help='HTTP status of injected failures')
+    parser.add_argument('--load-time', type=float, default=0.0,
+                        help='Seconds to load the model when a request finds it unloaded (0 = always loaded)')
+    parser.add_argument('--prompt-eval-rate', type=float, default=0.0,
+                        help='Prompt tokens evaluated per second, after the cached prefix (0 = instant)')
+
+def stub_options(args):
+    return {
+        "latency": args.latency,
+        "latency_distribution": args.latency_distribution,
+        "latency_max": args.latency_max,
+        "latency_sigma": args.latency_sigma,
+        "token_rate": args.token_rate,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "load_time": args.load_time,
+        "prompt_eval_rate": args.prompt_eval_rate
+    }
+
+def start_stub_server(**kwargs):
+    """Start a stub server on a background thread and return (server, base_url)"""
+    server = make_stub_server(**kwargs)
+    Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    server = make_stub_server(args.host, args.port, **stub_options(args))
+    print(f"Stub Ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
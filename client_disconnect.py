@@ -0,0 +1,103 @@
+"""Notice when an HTTP client hangs up while its request is still being answered.
+
+A non-streaming request spends most of its time waiting on Ollama without
+writing to the client, so a closed tab goes unnoticed until the answer is
+ready. DisconnectMonitor watches the client sockets of such requests from
+one background thread: a socket that turns readable with nothing left to
+read has been closed by the other side, and its callback runs so the
+generation can be abandoned.
+
+The socket comes from the WSGI environ (gunicorn and the Werkzeug
+development server both expose it); under other servers requests are simply
+not watched. Behind a reverse proxy this relies on the proxy closing its
+upstream connection when the client goes away, which nginx and most hosted
+load balancers do.
+"""
+import os
+import select
+import socket
+import logging
+from threading import Lock, Thread, Event
+
+logger = logging.getLogger(__name__)
+
+def client_socket(environ):
+    """The request's client socket, or None when the server doesn't expose it"""
+    return environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+
+def peer_closed(sock):
+    """Whether a readable socket was closed by its peer (rather than sent more data)"""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | getattr(socket, 'MSG_DONTWAIT', 0)) == b''
+    except (BlockingIOError, InterruptedError, ValueError):  # ValueError: TLS sockets can't peek
+        return False
+    except OSError:
+        return True  # Reset by peer
+
+class DisconnectMonitor:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._lock = Lock()
+        self._watched = {}  # socket -> callback
+        self._wake = Event()
+        self._thread = None
+        self.disconnects = 0
+
+    def watch(self, sock, on_disconnect):
+        """Call on_disconnect (once) if the client closes sock; returns a handle for unwatch"""
+        if sock is None:
+            return None
+        with self._lock:
+            self._watched[sock] = on_disconnect
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='disconnect-monitor', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return sock
+
+    def unwatch(self, handle):
+        if handle is not None:
+            with self._lock:
+                self._watched.pop(handle, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                sockets = list(self._watched)
+            if not sockets:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            try:
+                readable, _, _ = select.select(sockets, [], [], self.interval)
+            except (OSError, ValueError):
+                # A socket was closed while we waited on it; check them one at a time
+                readable = [sock for sock in sockets if sock.fileno() < 0 or self._readable(sock)]
+            for sock in readable:
+                with self._lock:
+                    callback = self._watched.pop(sock, None)
+                # A readable socket that isn't closed has a pipelined request waiting; stop
+                # watching it either way so select doesn't keep returning it
+                if callback is not None and (sock.fileno() < 0 or peer_closed(sock)):
+                    self.disconnects += 1
+                    try:
+                        callback()
+                    except Exception as e:
+                        logger.error(f"Disconnect callback failed: {e}")
+
+    @staticmethod
+    def _readable(sock):
+        try:
+            return bool(select.select([sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"watched": len(self._watched), "disconnects": self.disconnects}
+
+def create_disconnect_monitor():
+    """Build the monitor, or None when CANCEL_ON_DISCONNECT is turned off"""
+    if os.environ.get('CANCEL_ON_DISCONNECT', '1').lower() in ('0', 'false', 'no'):
+        return None
+    return DisconnectMonitor(interval=float(os.environ.get('DISCONNECT_POLL_INTERVAL', 0.5)))
@@ -0,0 +1,130 @@
+"""Convert model output into the [CODE]...[/CODE] markup the web page renders.
+
+Shared by app.py and api/index.py. Fenced code blocks with any language tag
+are converted in a single regex pass; responses without fences fall back to
+detecting code from per-language indicators. StreamingCodeFormatter applies
+the same fence conversion incrementally to streamed text.
+"""
+import re
+
+FALLBACK_MESSAGE = "I apologize, but I couldn't generate a response. Please try again with a simpler question."
+
+# ```lang\n ... ``` where lang is optional and may be any tag such as c++, c#, js or objective-c.
+# A block left open at the end (output cut off by num_predict) still counts as code.
+FENCE_TAG = r'[\w+#.-]*[ \t]*'
+FENCE_RE = re.compile(r'```' + FENCE_TAG + r'\n(.*?)(?:```|\Z)', re.DOTALL)
+FENCE_TAG_RE = re.compile(FENCE_TAG)
+
+# Checked in order; the first language with a match wins
+CODE_INDICATORS = {
+    'html': ['<html', '<body', '<div', '<p', '<script', '<style'],
+    'css': ['{', 'body {', '.class', '#id', '@media'],
+    'python': ['def ', 'class ', 'print(', 'return ', 'import ']
+}
+INDICATOR_RES = [
+    (lang, re.compile('|'.join(re.escape(indicator) for indicator in indicators)))
+    for lang, indicators in CODE_INDICATORS.items()
+]
+
+def _replace_fence(match):
+    return f'[CODE]{match.group(1).strip()}[/CODE]'
+
+def format_code_response(response):
+    if not response:
+        return FALLBACK_MESSAGE
+
+    # If response already contains our markers, return as is
+    if '[CODE]' in response:
+        return response
+
+    formatted_response, converted = FENCE_RE.subn(_replace_fence, response)
+    if converted:
+        return formatted_response
+
+    # No code blocks found, but the response may still look like code: everything
+    # from the first line containing an indicator onwards is treated as code
+    for lang, indicator_re in INDICATOR_RES:
+        match = indicator_re.search(response)
+        if match:
+            line_start = response.rfind('\n', 0, match.start()) + 1
+            code_block = response[line_start:]
+            return f'Here\'s the {lang.upper()} code:\n\n[CODE]{code_block.strip()}[/CODE]'
+
+    return response
+
+class StreamingCodeFormatter:
+    """Incrementally convert markdown code fences in streamed text into [CODE] markers"""
+
+    def __init__(self):
+        self.buffer = ''
+        self.in_code = False
+        self.code_started = False
+        self.held_whitespace = ''
+
+    def _emit_code(self, text):
+        # Mirror format_code_response, which strips whitespace around each code block
+        if not self.code_started:
+            text = text.lstrip()
+            if not text:
+                return ''
+            self.code_started = True
+        combined = self.held_whitespace + text
+        stripped = combined.rstrip()
+        self.held_whitespace = combined[len(stripped):]
+        return stripped
+
+    def feed(self, text):
+        """Add streamed text and return the portion that is safe to display"""
+        self.buffer += text
+        output = []
+        search_from = 0
+
+        while True:
+            fence = self.buffer.find('```', search_from)
+            if fence == -1:
+                # Hold back trailing backticks that may be the start of a fence
+                held = len(self.buffer) - len(self.buffer.rstrip('`'))
+                ready = self.buffer[:max(len(self.buffer) - held, search_from)]
+                self.buffer = self.buffer[len(ready):]
+                output.append(self._emit_code(ready) if self.in_code else ready)
+                break
+
+            if self.in_code:
+                output.append(self._emit_code(self.buffer[:fence]))
+                output.append('[/CODE]')
+                self.buffer = self.buffer[fence + 3:]
+                search_from = 0
+                self.in_code = False
+                continue
+
+            # Wait for the end of the opening fence line so the language tag is skipped
+            line_end = self.buffer.find('\n', fence)
+            tag = self.buffer[fence + 3:] if line_end == -1 else self.buffer[fence + 3:line_end]
+            if not FENCE_TAG_RE.fullmatch(tag):
+                # Inline backticks rather than a fence; keep them as text
+                search_from = fence + 3
+                continue
+            if line_end == -1:
+                output.append(self.buffer[:fence])
+                self.buffer = self.buffer[fence:]
+                break
+
+            output.append(self.buffer[:fence])
+            output.append('[CODE]')
+            self.buffer = self.buffer[line_end + 1:]
+            search_from = 0
+            self.in_code = True
+            self.code_started = False
+            self.held_whitespace = ''
+
+        return ''.join(output)
+
+    def flush(self):
+        """Return any held text once the stream has finished"""
+        if self.in_code:
+            output = self._emit_code(self.buffer) + '[/CODE]'
+        else:
+            output = self.buffer
+        self.buffer = ''
+        self.in_code = False
+        return output
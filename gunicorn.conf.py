@@ -0,0 +1,67 @@
+"""gunicorn settings for serving app.py in production.
+
+Generations spend almost all their time waiting on Ollama, so each worker
+runs many threads (gthread) rather than relying on more processes: a single
+worker with the default 128 threads can hold that many clients waiting on
+the admission queue or a stream. Conversation sessions and the in-memory
+caches live in each worker; with WEB_CONCURRENCY > 1, point the cache, rate
+limiter and circuit breaker at sqlite files so workers share them. Batch
+jobs must be shared too, since a poll can reach any worker: with more than
+one worker, BATCH_STORE_PATH defaults to a sqlite file instead of memory.
+
+On SIGTERM a worker stops accepting connections, reports not-ready on
+/ready, and gets GRACEFUL_TIMEOUT seconds to finish in-flight generations.
+"""
+import os
+import signal
+
+import ollama_client
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+if workers > 1:
+    # Read by each worker's app; an in-memory store would 404 polls that reach another worker
+    os.environ.setdefault('BATCH_STORE_PATH', 'batch_jobs.sqlite3')
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 128))
+# Longer than the longest generation timeout (TIMEOUT_MAX) so it can finish
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 130))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 180))
+keepalive = 5
+accesslog = '-'
+
+STARTUP_TIMEOUT = float(os.environ.get('STARTUP_TIMEOUT', 60))
+STARTUP_REQUIRE_MODEL = os.environ.get('STARTUP_REQUIRE_MODEL', '').lower() in ('1', 'true', 'yes')
+
+def on_starting(server):
+    """Wait for Ollama to come up with the model before starting workers"""
+    try:
+        ready = ollama_client.wait_until_ready(timeout=STARTUP_TIMEOUT)
+    finally:
+        # Workers fork from the master; each must open its own connections, not share this one
+        ollama_client.close_session()
+    if ready:
+        return
+    message = f"Ollama with {ollama_client.DEFAULT_MODEL} was not ready after {STARTUP_TIMEOUT:.0f}s"
+    if STARTUP_REQUIRE_MODEL:
+        raise SystemExit(message)
+    server.log.warning(f"{message}; starting anyway, requests will fail fast until it is")
+
+def post_worker_init(worker):
+    import app
+
+    stop_worker = signal.getsignal(signal.SIGTERM)
+
+    def drain(signum, frame):
+        app.begin_shutdown()
+        stop_worker(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain)
+
+def worker_exit(server, worker):
+    import app
+    app.model_keeper.stop()
+    app.ollama_pool.stop()
+    app.batch_manager.shutdown()
+    ollama_client.close_session()
+    app.async_logging.stop()
@@ -0,0 +1,171 @@
+"""Keep the models loaded on every Ollama server while the app is in use.
+
+Ollama loads a model on its first request and unloads it after `keep_alive`
+(5 minutes by default) without requests, so the first question after a lull
+pays the full load time. ModelKeeper preloads its models (every model the
+routing table can send a message to) on each server at startup, then, as
+long as the app has had traffic within the keep_alive window, pings every
+server so none of them unloads one between requests. Once traffic stops,
+the pings stop too and Ollama unloads the models after keep_alive, which is
+how operators choose the unload-after-idle delay.
+"""
+import os
+import re
+import time
+import logging
+from threading import Thread, Event
+
+import ollama_client
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_DEFAULT_KEEP_ALIVE = 300  # Seconds Ollama keeps a model loaded when keep_alive isn't sent
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_keep_alive(value):
+    """Turn a keep_alive setting into (payload value, seconds); seconds is None for 'forever'.
+
+    Accepts what Ollama does: a number of seconds, a duration like '30m' or
+    '1h30m', or a negative number to never unload.
+    """
+    if value is None or value == '':
+        return None, OLLAMA_DEFAULT_KEEP_ALIVE
+    value = str(value).strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        parts = DURATION_RE.findall(value)
+        if not parts or ''.join(number + unit for number, unit in parts) != value:
+            raise ValueError(f"Invalid keep_alive duration: {value}")
+        return value, sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+    payload_value = int(seconds) if seconds.is_integer() else seconds
+    return payload_value, None if seconds < 0 else seconds
+
+class ModelKeeper:
+    def __init__(self, pool, models=(ollama_client.DEFAULT_MODEL,), keep_alive=None, ping_interval=60.0,
+                 warmup=True, load_timeout=300.0):
+        self.pool = pool
+        self.models = list(dict.fromkeys(models))  # Distinct, in routing order
+        self.keep_alive, self.keep_alive_seconds = parse_keep_alive(keep_alive)
+        if self.keep_alive_seconds:
+            # A ping has to land before keep_alive runs out for it to keep the model loaded
+            ping_interval = min(ping_interval, self.keep_alive_seconds / 2)
+        self.ping_interval = ping_interval
+        self.warmup = warmup
+        self.load_timeout = load_timeout
+        self.last_activity = time.monotonic()
+        self.warmed_up = Event()
+        self.warmups = 0
+        self.pings = 0
+        self.failures = 0
+        self._stop = Event()
+        self._thread = None
+        if not warmup:
+            self.warmed_up.set()
+
+    def apply(self, payload):
+        """Add the configured keep_alive to a generate payload"""
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def record_activity(self):
+        self.last_activity = time.monotonic()
+
+    def recently_active(self):
+        if self.keep_alive_seconds is None:
+            return True
+        return time.monotonic() - self.last_activity < self.keep_alive_seconds
+
+    def load(self, backend, model):
+        """Ask one server to load a model (or keep it loaded); a request without a prompt only loads it"""
+        started = time.monotonic()
+        try:
+            response = ollama_client.post_generate(
+                self.apply({"model": model}), timeout=self.load_timeout, base_url=backend.url
+            )
+            response.raise_for_status()
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Could not load {model} on {backend.url}: {e}")
+            return False
+        backend.loaded_models.add(model if ':' in model else f"{model}:latest")
+        elapsed = time.monotonic() - started
+        if elapsed > 1:
+            logger.info(f"Loaded {model} on {backend.url} in {elapsed:.1f}s")
+        return True
+
+    def load_all(self, backend):
+        """Load every model on one server; True if all of them loaded"""
+        return all([self.load(backend, model) for model in self.models])
+
+    def refresh_loaded_state(self):
+        for backend in self.pool.backends:
+            try:
+                backend.loaded_models = set(ollama_client.get_loaded_models(backend.url))
+            except Exception:
+                pass  # Health is the pool's business; keep the last known state
+
+    def warm(self):
+        """Load the models on every server that can take requests, returning how many servers have them all"""
+        backends = [backend for backend in self.pool.backends if backend.available()]
+        loaded = sum(self.load_all(backend) for backend in backends)
+        self.warmups += 1
+        return loaded
+
+    def ping(self):
+        """Reset the keep_alive timers on every server, reloading models where they were unloaded"""
+        for backend in self.pool.backends:
+            if backend.available():
+                self.load_all(backend)
+        self.pings += 1
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='model-keeper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        if self.warmup:
+            loaded = self.warm()
+            if loaded:
+                logger.info(f"Warmed up {', '.join(self.models)} on {loaded} of {len(self.pool.backends)} Ollama servers")
+            self.warmed_up.set()  # Even on failure, so readiness falls back to the circuit breakers
+        while not self._stop.wait(self.ping_interval):
+            if self.recently_active():
+                self.ping()
+            else:
+                self.refresh_loaded_state()  # Let /ready show the model being unloaded after idle
+
+    def stop(self):
+        self._stop.set()
+
+    def model_loaded(self, backend, model=None):
+        """Whether a model, or by default every model, was loaded on a server when last checked"""
+        return all(backend.has_model(model) for model in ([model] if model else self.models))
+
+    def stats(self):
+        return {
+            "models": self.models,
+            "keep_alive": self.keep_alive,
+            "warmed_up": self.warmed_up.is_set(),
+            "idle_seconds": round(time.monotonic() - self.last_activity, 1),
+            "warmups": self.warmups,
+            "pings": self.pings,
+            "failures": self.failures,
+            "loaded_on": {
+                model: [backend.url for backend in self.pool.backends if self.model_loaded(backend, model)]
+                for model in self.models
+            }
+        }
+
+def create_model_keeper(pool, models=(ollama_client.DEFAULT_MODEL,)):
+    """Build the keeper for models, configured by OLLAMA_KEEP_ALIVE, MODEL_WARMUP and MODEL_PING_INTERVAL"""
+    return ModelKeeper(
+        pool,
+        models=models,
+        keep_alive=os.environ.get('OLLAMA_KEEP_ALIVE') or None,
+        ping_interval=float(os.environ.get('MODEL_PING_INTERVAL', 60)),
+        warmup=os.environ.get('MODEL_WARMUP', '1').lower() not in ('0', 'false', 'no')
+    )
@@ -0,0 +1,158 @@
+"""Send each message to the model suited to it.
+
+A classifier sorts messages into 'general' and 'code', and messages whose
+prompt has to be split into chunks become 'long'. Each of these routes has
+its own model and generation options, so a small fast model can answer
+general questions while CodeLlama handles code, and long prompts can get a
+bigger context window. Every route defaults to the same model and options,
+which leaves routing off until models are configured:
+
+    ROUTE_GENERAL_MODEL=llama3.2:1b
+    ROUTE_GENERAL_OPTIONS={"num_predict": 192}
+    ROUTE_LONG_OPTIONS={"num_ctx": 4096, "num_predict": 512}
+
+The classifier is any callable taking the message and returning 'general'
+or 'code'. ROUTING_CLASSIFIER picks the built-in keyword classifier
+('keywords') or one of your own as 'package.module:callable'.
+"""
+import os
+import re
+import json
+import logging
+import importlib
+from threading import Lock
+
+from resilience import LatencyTracker, create_latency_tracker
+
+logger = logging.getLogger(__name__)
+
+GENERAL = 'general'
+CODE = 'code'
+LONG = 'long'
+ROUTE_NAMES = (GENERAL, CODE, LONG)
+
+CODE_KEYWORDS = (
+    'code', 'function', 'class', 'method', 'example', 'implement', 'script', 'program', 'algorithm',
+    'bug', 'debug', 'error', 'exception', 'compile', 'refactor', 'regex', 'sql', 'query', 'api',
+    'python', 'javascript', 'typescript', 'java', 'c++', 'c#', 'golang', 'rust', 'ruby', 'php', 'bash',
+    'html', 'css', 'react', 'node', 'django', 'flask', 'loop', 'array', 'list', 'dict', 'string', 'recursion'
+)
+# Text that only appears in code: fences, calls, definitions, operators and statement endings
+CODE_PATTERN_RE = re.compile(r"```|\bdef\s+\w+|\w+\([^)]*\)|[{};]\s*$|=>|==|!=|<\w+>|</\w+>", re.MULTILINE)
+
+class KeywordClassifier:
+    """Code questions mention a programming term as a whole word or contain code"""
+
+    def __init__(self, keywords=CODE_KEYWORDS):
+        # Whole words, plurals included: 'class' matches 'classes' but not 'classic', nor 'css' 'access'
+        self.keywords_re = re.compile(
+            r"(?<![\w+#])(?:" + '|'.join(re.escape(keyword) for keyword in keywords) + r")(?:e?s)?(?![\w+#])",
+            re.IGNORECASE
+        )
+
+    def __call__(self, message):
+        if self.keywords_re.search(message) or CODE_PATTERN_RE.search(message):
+            return CODE
+        return GENERAL
+
+class Route:
+    def __init__(self, name, model, options=None, latency=None):
+        self.name = name
+        self.model = model
+        self.options = dict(options or {})
+        # Also sets the timeout of the route's generations, which differ in speed from model to model
+        self.latency = latency if latency is not None else LatencyTracker(min_samples=1)
+        self.requests = 0
+        self.errors = 0
+        self._lock = Lock()
+
+    def apply(self, payload):
+        """Point a generate payload at this route's model and options"""
+        payload.update(self.options)
+        payload["model"] = self.model
+        return payload
+
+    def with_template(self, template):
+        """This route, also sending the template's instructions as the system prompt"""
+        return TemplatedRoute(self, template)
+
+    def record(self, seconds, ok=True):
+        self.latency.record(seconds)
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+
+    def stats(self):
+        latency = self.latency.stats()
+        return {
+            "model": self.model,
+            "options": self.options,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency": {key: latency[key] for key in ("samples", "p50", "p95", "p99", "timeout")}
+        }
+
+class TemplatedRoute:
+    """A route bound to a prompt template for one message; stats go to the route"""
+
+    def __init__(self, route, template):
+        self.route = route
+        self.template = template
+        self.name = route.name
+        self.model = route.model
+        self.latency = route.latency
+
+    def apply(self, payload):
+        return self.template.apply(self.route.apply(payload))
+
+    def record(self, seconds, ok=True):
+        self.route.record(seconds, ok)
+
+class ModelRouter:
+    def __init__(self, routes, classifier=None):
+        self.routes = {route.name: route for route in routes}
+        self.classifier = classifier or KeywordClassifier()
+
+    def classify(self, message):
+        """'general' or 'code'; a failing classifier falls back to 'code', the safe choice"""
+        try:
+            category = self.classifier(message)
+        except Exception as e:
+            logger.warning(f"Request classifier failed, routing as code: {e}")
+            return CODE
+        return category if category in (GENERAL, CODE) else CODE
+
+    def route(self, category, chunk_count=1):
+        """The route for a classified message whose prompt splits into chunk_count chunks"""
+        if chunk_count > 1:
+            return self.routes[LONG]
+        return self.routes[category]
+
+    def stats(self):
+        return {
+            "classifier": getattr(self.classifier, '__name__', type(self.classifier).__name__),
+            "routes": {name: route.stats() for name, route in self.routes.items()}
+        }
+
+def load_classifier(spec):
+    """'keywords' or 'package.module:callable'"""
+    if spec in ('', 'keywords'):
+        return KeywordClassifier()
+    module_name, _, attribute = spec.partition(':')
+    if not attribute:
+        raise ValueError(f"ROUTING_CLASSIFIER must be 'keywords' or 'module:callable', got {spec}")
+    return getattr(importlib.import_module(module_name), attribute)
+
+def create_model_router(default_model):
+    """Build the router configured by ROUTING_CLASSIFIER and ROUTE_<NAME>_MODEL / _OPTIONS"""
+    routes = []
+    for name in ROUTE_NAMES:
+        prefix = f'ROUTE_{name.upper()}'
+        options = json.loads(os.environ.get(f'{prefix}_OPTIONS') or '{}')
+        if not isinstance(options, dict):
+            raise ValueError(f"{prefix}_OPTIONS must be a JSON object")
+        routes.append(Route(
+            name, os.environ.get(f'{prefix}_MODEL') or default_model, options, latency=create_latency_tracker()
+        ))
+    return ModelRouter(routes, load_classifier(os.environ.get('ROUTING_CLASSIFIER', 'keywords')))
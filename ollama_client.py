@@ -0,0 +1,166 @@
+"""Shared Ollama HTTP client with keep-alive connection pooling.
+
+app.py, api/index.py and sour_chatbot.py all talk to Ollama through this
+module so that retries and follow-up requests reuse open TCP connections
+instead of opening a new one per call.
+"""
+import os
+import json
+import time
+import logging
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # The async client is optional
+    aiohttp = None
+
+# May list several comma-separated servers; app.py spreads load across all of
+# them (see backend_pool.py), other callers use the first
+OLLAMA_API_URLS = [
+    url.strip().rstrip('/')
+    for url in os.environ.get('OLLAMA_API_URL', 'http://localhost:11434').split(',')
+    if url.strip()
+]
+OLLAMA_API_URL = OLLAMA_API_URLS[0]
+DEFAULT_MODEL = 'codellama'
+POOL_SIZE = int(os.environ.get('OLLAMA_POOL_SIZE', 20))  # Max keep-alive connections per host
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = Lock()
+
+def get_session():
+    """Return the process-wide pooled requests session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=max(4, len(OLLAMA_API_URLS)), pool_maxsize=POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+def close_session():
+    """Close pooled connections, e.g. on shutdown or after a fork"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def post_generate(payload, stream=False, timeout=120, base_url=None):
+    """POST a payload to /api/generate over a pooled connection.
+
+    Returns the requests.Response; streamed responses must be closed (or used
+    as a context manager) so the connection goes back to the pool.
+    """
+    url = f"{base_url or OLLAMA_API_URL}/api/generate"
+    return get_session().post(url, json=payload, stream=stream, timeout=timeout)
+
+def post_embeddings(model, prompt, timeout=10, base_url=None):
+    """Return the embedding vector of a text from /api/embeddings"""
+    response = get_session().post(
+        f"{base_url or OLLAMA_API_URL}/api/embeddings", json={"model": model, "prompt": prompt}, timeout=timeout
+    )
+    response.raise_for_status()
+    return response.json()['embedding']
+
+def model_matches(name, model):
+    """Whether a model name reported by Ollama refers to the requested model ('codellama' == 'codellama:latest')"""
+    if ':' not in model:
+        model += ':latest'
+    return name == model
+
+def _model_names(base_url, path, timeout):
+    response = get_session().get(f"{base_url or OLLAMA_API_URL}{path}", timeout=timeout)
+    response.raise_for_status()
+    return [model['name'] for model in response.json().get('models', [])]
+
+def get_loaded_models(base_url=None, timeout=5):
+    """Names of the models a server currently holds in memory, from /api/ps"""
+    return _model_names(base_url, '/api/ps', timeout)
+
+def get_installed_models(base_url=None, timeout=5):
+    """Names of the models a server has pulled, from /api/tags"""
+    return _model_names(base_url, '/api/tags', timeout)
+
+def wait_until_ready(model=DEFAULT_MODEL, timeout=60, interval=2, base_urls=None):
+    """Poll until some server answers and has the model installed; returns False after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while True:
+        for base_url in base_urls or OLLAMA_API_URLS:
+            try:
+                if any(model_matches(name, model) for name in get_installed_models(base_url)):
+                    logger.info(f"Ollama at {base_url} is ready with {model}")
+                    return True
+                logger.warning(f"Ollama at {base_url} does not have {model}; run: ollama pull {model}")
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Ollama at {base_url} is not reachable yet: {e}")
+        if time.monotonic() + interval > deadline:
+            return False
+        time.sleep(interval)
+
+class AsyncOllamaClient:
+    """asyncio flavour of the client, backed by an aiohttp connection pool.
+
+    A single event loop can keep many generations in flight without a thread
+    per request. Requires the optional aiohttp package.
+    """
+
+    def __init__(self, base_url=None, pool_size=None):
+        if aiohttp is None:
+            raise RuntimeError("AsyncOllamaClient requires aiohttp (pip install aiohttp)")
+        self.base_url = base_url or OLLAMA_API_URL
+        self.pool_size = pool_size or POOL_SIZE
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def generate(self, payload, timeout=120):
+        """Return the decoded JSON result of a non-streaming generation"""
+        payload = dict(payload, stream=False)
+        async with self._get_session().post(
+            f"{self.base_url}/api/generate",
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def stream_generate(self, payload, timeout=120):
+        """Yield decoded chunks of a streaming generation as they arrive"""
+        payload = dict(payload, stream=True)
+        async with self._get_session().post(
+            f"{self.base_url}/api/generate",
+            json=payload,
+            timeout=aiohttp.ClientTimeout(sock_read=timeout)
+        ) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip():
+                    chunk = json.loads(line)
+                    yield chunk
+                    if chunk.get('done'):
+                        break
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,144 @@
+"""Split prompts that don't fit the model's context into as few pieces as possible.
+
+Token counts are estimated locally, without the model's tokenizer: words are
+counted at roughly four characters per token and every punctuation mark as
+a token of its own, which errs on the high side for English and code
+alike. Splitting prefers line and sentence boundaries, never cuts inside a
+fenced code block unless the block alone is over budget (then it is split
+between lines), keeps lines that look like code whole with their
+indentation even outside fences, and repeats the end of each chunk at the
+start of the next so a thought cut at a boundary keeps its context.
+"""
+import math
+import re
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+FENCE_BLOCK_RE = re.compile(r"```.*?(?:```|\Z)", re.DOTALL)
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+# Unfenced lines that are probably code: indented, opening or closing a block or a statement,
+# or starting with a keyword or comment marker
+CODE_LINE_RE = re.compile(
+    r"^\s+\S|[{}();:,\[\]]\s*$|^\s*(?:def|class|import|from|return|if|elif|else|for|while|try|except|"
+    r"with|function|const|let|var|public|private|#|//|@)(?:\W|$)"
+)
+
+def estimate_tokens(text):
+    """Rough upper estimate of a LLaMA-style token count"""
+    return sum(math.ceil(len(piece) / 4) for piece in TOKEN_RE.findall(text))
+
+def _split_lines(block, max_tokens):
+    """Split an oversized code block between lines, keeping every piece a valid fence"""
+    lines = block.split('\n')
+    opening = lines[0]
+    closing = '```' if block.rstrip().endswith('```') and len(lines) > 1 else ''
+    body = lines[1:-1] if closing else lines[1:]
+    pieces = []
+    current = []
+    budget = max_tokens - estimate_tokens(opening + closing)
+    for line in body:
+        if current and estimate_tokens('\n'.join(current + [line])) > budget:
+            pieces.append('\n'.join([opening] + current + ['```']))
+            current = []
+        current.append(line)
+    pieces.append('\n'.join([opening] + current + ['```']))
+    return pieces
+
+def _segments(prompt, max_tokens):
+    """Yield (text, is_code, separator) units that splitting must not cut further;
+    separator is what goes between the unit and the one before it"""
+    position = 0
+    for match in FENCE_BLOCK_RE.finditer(prompt):
+        yield from _lines(prompt[position:match.start()])
+        block = match.group(0)
+        if estimate_tokens(block) <= max_tokens:
+            yield block, True, '\n'
+        else:
+            for piece in _split_lines(block, max_tokens):
+                yield piece, True, '\n'
+        position = match.end()
+    yield from _lines(prompt[position:])
+
+def _lines(text):
+    """Each line's sentences; a line that looks like code is one unit, indentation included"""
+    separator = '\n'
+    for line in text.split('\n'):
+        if not line.strip():
+            separator = '\n\n'  # Keep paragraph breaks and blank lines between definitions
+            continue
+        if CODE_LINE_RE.search(line):
+            yield line.rstrip(), False, separator
+        else:
+            sentences = [sentence.strip() for sentence in SENTENCE_END_RE.split(line) if sentence.strip()]
+            for index, sentence in enumerate(sentences):
+                yield sentence, False, separator if index == 0 else ' '
+        separator = '\n'
+
+def _split_words(sentence, max_tokens):
+    """Last resort for a single sentence over budget"""
+    pieces = []
+    current = []
+    for word in sentence.split():
+        if current and estimate_tokens(' '.join(current + [word])) > max_tokens:
+            pieces.append(' '.join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(' '.join(current))
+    return pieces
+
+def split_prompt(prompt, max_tokens=200, overlap_tokens=24):
+    """Return the prompt as a list of chunks of at most about max_tokens each.
+
+    A prompt that fits comes back as a single chunk. Each later chunk begins
+    with the trailing sentences (up to overlap_tokens) of the one before it.
+    """
+    if estimate_tokens(prompt) <= max_tokens:
+        return [prompt]
+
+    units = []
+    for text, is_code, separator in _segments(prompt, max_tokens):
+        if not is_code and estimate_tokens(text) > max_tokens:
+            units.extend(
+                (piece, False, separator if index == 0 else ' ')
+                for index, piece in enumerate(_split_words(text, max_tokens))
+            )
+        else:
+            units.append((text, is_code, separator))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        tokens = estimate_tokens(unit[0])
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(_join(current))
+            current = _overlap(current, overlap_tokens, max_tokens - tokens)
+            current_tokens = sum(estimate_tokens(text) for text, _, _ in current)
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append(_join(current))
+    return chunks
+
+def _join(units):
+    text = ''
+    previous_code = False
+    for unit, is_code, separator in units:
+        if text:
+            text += '\n' if previous_code and separator == ' ' else separator
+        text += unit
+        previous_code = is_code
+    return text
+
+def _overlap(units, overlap_tokens, room):
+    """Trailing prose sentences of a finished chunk to carry into the next one"""
+    carried = []
+    total = 0
+    for text, is_code, separator in reversed(units):
+        tokens = estimate_tokens(text)
+        # Code blocks are not repeated: they are long and answering them twice wastes a call's worth of output
+        if is_code or total + tokens > min(overlap_tokens, room):
+            break
+        carried.insert(0, (text, is_code, separator))
+        total += tokens
+    return carried
@@ -0,0 +1,115 @@
+"""Fixed instructions sent with every message, shared by the app, the serverless API and the CLI.
+
+The instructions used to be written around each message in the prompt,
+with the message first, so no two prompts shared more than a few words and
+Ollama evaluated the whole block again on every request. A template sends
+them as the `system` field instead. The model's chat template puts the
+system prompt before the message, so every request with the same template
+starts with the same tokens, and Ollama reuses the evaluated prefix it
+keeps from earlier requests; only the message itself is evaluated.
+
+Templates are registered by name. The code and general templates are used
+for messages classified as code or general questions.
+"""
+
+class PromptTemplate:
+    def __init__(self, name, system, prompt='{message}', options=None):
+        self.name = name
+        self.system = system
+        self.prompt = prompt
+        self.options = dict(options or {})
+
+    def render(self, message):
+        """The prompt sent for a message; the instructions travel separately"""
+        return self.prompt.format(message=message)
+
+    def apply(self, payload):
+        """Add the template's instructions, and any options they need, to a generate payload"""
+        payload.update(self.options)
+        payload["system"] = self.system
+        return payload
+
+TEMPLATES = {}
+
+def register_template(name, system, prompt='{message}', options=None):
+    template = TEMPLATES[name] = PromptTemplate(name, system, prompt, options)
+    return template
+
+def get_template(name):
+    return TEMPLATES[name]
+
+def template_for(category):
+    """The template for a message the classifier put in category ('code' or 'general')"""
+    return TEMPLATES['code'] if category == 'code' else TEMPLATES['general']
+
+CODE = register_template('code', """You are SOUR, a coding assistant. Provide a clear and concise code example for each request.
+
+Requirements:
+1. Start with a brief explanation of the solution
+2. Include well-commented code with clear variable names
+3. Add example usage showing input and output
+4. Keep the code simple and efficient
+5. Use Python best practices and PEP 8 style
+
+Format the response like this:
+[Explanation of the solution]
+
+[CODE]
+# Your code here
+[/CODE]
+
+[Example usage]""", 'Please provide a clear and concise code example for: {message}')
+
+GENERAL = register_template('general', """You are SOUR, a coding assistant. Help with each request.
+
+If code would be helpful, include:
+1. Clear explanation of the concept
+2. Relevant code examples in this format:
+   [CODE]
+   # Your code here
+   [/CODE]
+3. Key points to understand
+4. Common pitfalls to avoid""", 'Please help with: {message}')
+
+# Every social media website request gets the same prompt, so it is answered once and cached.
+# The HTML alone nearly fills the default context window
+SOCIAL_MEDIA = register_template('social_media', """Complete this HTML template with social media links:
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Social Links</title>
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.4/css/all.min.css">
+    <style>
+        body {
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            min-height: 100vh;
+            margin: 0;
+            background: #f0f2f5;
+        }
+        .social-links {
+            display: flex;
+            gap: 20px;
+        }
+        .social-links a {
+            color: #1877f2;
+            font-size: 24px;
+            transition: transform 0.3s;
+        }
+        .social-links a:hover {
+            transform: scale(1.2);
+        }
+    </style>
+</head>
+<body>
+    <div class="social-links">
+        <!-- Add links for Twitter, Facebook, and Instagram using Font Awesome icons -->
+    </div>
+</body>
+</html>""", 'Add the Twitter, Facebook and Instagram links and return the complete HTML.', {"num_ctx": 1024})
+
+def is_social_media_request(message):
+    return "website" in message.lower() and "social media" in message.lower()
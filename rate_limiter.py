@@ -0,0 +1,122 @@
+"""Per-client token-bucket rate limiting.
+
+Each client gets a bucket holding up to `burst` tokens that refills at
+`rate` tokens per second; a request spends one token. Limiters never sleep:
+`allow()` answers immediately with whether the request may proceed and, if
+not, how many seconds until it would.
+
+MemoryRateLimiter keeps buckets in lock-sharded LRU maps with a bounded
+number of clients. SqliteRateLimiter stores buckets in a shared database
+file so limits hold across several gunicorn workers on one host.
+"""
+import os
+import time
+import sqlite3
+import zlib
+from threading import Lock
+from collections import OrderedDict
+
+class RateLimiter:
+    def __init__(self, rate=5.0, burst=20):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        # A bucket idle this long has refilled completely, so forgetting it is lossless
+        self.idle_timeout = self.burst / self.rate
+
+    def _refill(self, tokens, updated, now):
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def _decide(self, tokens):
+        """Return (allowed, remaining tokens, retry_after) for a refilled bucket"""
+        if tokens >= 1:
+            return True, tokens - 1, 0.0
+        return False, tokens, (1 - tokens) / self.rate
+
+    def allow(self, client_id):
+        raise NotImplementedError
+
+class MemoryRateLimiter(RateLimiter):
+    """In-process limiter with sharded locks and bounded memory"""
+
+    def __init__(self, rate=5.0, burst=20, shards=16, max_clients=10000):
+        super().__init__(rate, burst)
+        self.max_clients_per_shard = max(1, max_clients // shards)
+        self._shards = [(Lock(), OrderedDict()) for _ in range(shards)]
+
+    def _shard(self, client_id):
+        return self._shards[zlib.crc32(client_id.encode()) % len(self._shards)]
+
+    def allow(self, client_id):
+        now = time.monotonic()
+        lock, buckets = self._shard(client_id)
+        with lock:
+            bucket = buckets.pop(client_id, None)  # Re-inserted below as most recently used
+            tokens = self.burst if bucket is None else self._refill(*bucket, now)
+            allowed, tokens, retry_after = self._decide(tokens)
+            buckets[client_id] = (tokens, now)
+            self._evict(buckets, now)
+        return allowed, retry_after
+
+    def _evict(self, buckets, now):
+        # Oldest entries come first, so stop at the first one that is still active
+        while buckets:
+            client_id, (tokens, updated) = next(iter(buckets.items()))
+            if now - updated < self.idle_timeout and len(buckets) <= self.max_clients_per_shard:
+                break
+            buckets.popitem(last=False)
+
+    def __len__(self):
+        return sum(len(buckets) for _, buckets in self._shards)
+
+class SqliteRateLimiter(RateLimiter):
+    """Limiter whose buckets live in a sqlite file shared between worker processes"""
+
+    def __init__(self, rate=5.0, burst=20, path='rate_limits.sqlite3'):
+        super().__init__(rate, burst)
+        self.path = path
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "client TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._last_cleanup = 0.0
+
+    def allow(self, client_id):
+        with self._lock:
+            # BEGIN IMMEDIATE serializes the read-modify-write across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()  # Wall clock, since monotonic time is per process
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE client = ?", (client_id,)
+                ).fetchone()
+                tokens = self.burst if row is None else self._refill(row[0], row[1], now)
+                allowed, tokens, retry_after = self._decide(tokens)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (client, tokens, updated) VALUES (?, ?, ?)",
+                    (client_id, tokens, now)
+                )
+                if now - self._last_cleanup > 60:
+                    self._conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self.idle_timeout,))
+                    self._last_cleanup = now
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return allowed, retry_after
+
+def create_rate_limiter():
+    """Build the limiter configured by the RATE_LIMIT_* environment variables"""
+    backend = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+    rate = float(os.environ.get('RATE_LIMIT_RATE', 5.0))  # Sustained requests per second
+    burst = float(os.environ.get('RATE_LIMIT_BURST', 20))
+
+    if backend in ('none', 'off', ''):
+        return None
+    if backend == 'sqlite':
+        return SqliteRateLimiter(rate, burst, os.environ.get('RATE_LIMIT_PATH', 'rate_limits.sqlite3'))
+    if backend == 'memory':
+        return MemoryRateLimiter(rate, burst, max_clients=int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', 10000)))
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
@@ -0,0 +1,251 @@
+"""Bounded, priority-aware admission queue in front of Ollama.
+
+At most `max_concurrent` generations run at once. Further requests wait in
+a priority queue of at most `max_depth` entries for up to `max_wait`
+seconds; when the queue is full they are shed immediately so the caller
+can answer 503 instead of piling more load onto the model server.
+
+Within a priority class, waiting requests are ordered by weighted fair
+queuing across clients: each request is stamped with a virtual finish time
+of its client's previous finish (or the current virtual time, if later)
+plus its cost divided by the client's weight. A client sending many
+requests, or requests that fan out into many generations, thus only
+delays itself. While others are waiting, a client already holding
+`max_per_client` slots is passed over.
+"""
+import os
+import time
+import heapq
+import itertools
+from threading import Condition
+from contextlib import contextmanager
+
+# Lower values are admitted first
+PRIORITY_INTERACTIVE = 0  # Short questions answered by a single generation
+PRIORITY_BULK = 1         # Long prompts that fan out into several chunk generations
+
+class QueueFullError(Exception):
+    """Raised when the wait queue is at capacity and the request is shed"""
+
+class QueueTimeoutError(Exception):
+    """Raised when a request waited longer than the queue's max_wait"""
+
+class QueueCancelledError(Exception):
+    """Raised when the caller's cancel_event was set while it waited, e.g. its client went away"""
+
+CANCEL_CHECK_INTERVAL = 0.25  # Seconds between checks of a waiting caller's cancel_event
+
+class Ticket:
+    """A request's place in the queue"""
+
+    def __init__(self, priority, seq, client=None, cost=1, finish=0.0):
+        self.priority = priority
+        self.seq = seq
+        self.client = client
+        self.cost = cost
+        self.finish = finish  # Virtual finish time; orders tickets within a priority class
+        self.state = 'waiting'  # waiting -> admitted -> released, or waiting -> cancelled
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+
+    @property
+    def wait_time(self):
+        return (self.admitted_at or time.monotonic()) - self.enqueued_at
+
+    @property
+    def key(self):
+        return (self.priority, self.finish, self.seq)
+
+class ClientState:
+    """A client's requests in the queue and its fair-queuing clock"""
+
+    def __init__(self):
+        self.active = 0
+        self.waiting = 0
+        self.active_cost = 0
+        self.finish = 0.0
+
+class AdmissionQueue:
+    def __init__(self, max_concurrent=4, max_depth=32, max_wait=60.0, max_per_client=None, weights=None):
+        self.max_concurrent = max_concurrent
+        self.max_depth = max_depth
+        self.max_wait = max_wait
+        self.max_per_client = max_per_client or max(1, max_concurrent // 2)
+        self.weights = weights or {}
+        self._cond = Condition()
+        self._heap = []
+        self._active = 0
+        self._seq = itertools.count()
+        self._clients = {}
+        self._virtual_time = {}  # Per priority class: finish time of the last admitted ticket
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+
+    def enqueue(self, priority=PRIORITY_INTERACTIVE, client=None, cost=1):
+        """Take a ticket, admitted immediately if a slot is free; raises QueueFullError.
+
+        cost is the work the request will put on the model server, such as
+        its number of generations.
+        """
+        with self._cond:
+            if (self._active >= self.max_concurrent or self._heap) and len(self._heap) >= self.max_depth:
+                self.rejected += 1
+                raise QueueFullError(f"Queue is full ({self.max_depth} requests waiting)")
+            state = self._clients.setdefault(client, ClientState())
+            start = max(self._virtual_time.get(priority, 0.0), state.finish)
+            state.finish = start + cost / self.weights.get(client, 1.0)
+            ticket = Ticket(priority, next(self._seq), client, cost, state.finish)
+            if self._active < self.max_concurrent and not self._heap:
+                self._admit(ticket)
+                return ticket
+            state.waiting += 1
+            heapq.heappush(self._heap, (ticket.key, ticket))
+            return ticket
+
+    def wait(self, ticket, timeout=None):
+        """Block until the ticket is admitted or the timeout passes; returns True if admitted"""
+        with self._cond:
+            self._cond.wait_for(lambda: ticket.state != 'waiting', timeout)
+            return ticket.state == 'admitted'
+
+    def position(self, ticket):
+        """1-based position among waiting requests, or 0 once admitted"""
+        with self._cond:
+            if ticket.state != 'waiting':
+                return 0
+            return 1 + sum(1 for key, _ in self._heap if key < ticket.key)
+
+    def release(self, ticket):
+        """Give back an admitted slot or withdraw a waiting ticket; safe to call twice"""
+        with self._cond:
+            if ticket.state == 'admitted':
+                self._active -= 1
+                ticket.state = 'released'
+                state = self._clients[ticket.client]
+                state.active -= 1
+                state.active_cost -= ticket.cost
+                self._forget_idle(ticket.client)
+                self._admit_waiting()
+            elif ticket.state == 'waiting':
+                ticket.state = 'cancelled'
+                self._heap = [entry for entry in self._heap if entry[1] is not ticket]
+                heapq.heapify(self._heap)
+                self._clients[ticket.client].waiting -= 1
+                self._forget_idle(ticket.client)
+
+    def admit(self, priority=PRIORITY_INTERACTIVE, timeout=None, client=None, cost=1, cancel_event=None):
+        """Enqueue and wait; raises QueueFullError, QueueTimeoutError or, once cancel_event is set, QueueCancelledError"""
+        ticket = self.enqueue(priority, client, cost)
+        timeout = self.max_wait if timeout is None else timeout
+        if cancel_event is None:
+            admitted = self.wait(ticket, timeout)
+        else:
+            deadline = time.monotonic() + timeout
+            admitted = False
+            while not admitted and not cancel_event.is_set() and time.monotonic() < deadline:
+                admitted = self.wait(ticket, min(CANCEL_CHECK_INTERVAL, deadline - time.monotonic()))
+            if not admitted and cancel_event.is_set():
+                self.release(ticket)
+                with self._cond:
+                    self.cancelled += 1
+                raise QueueCancelledError("Gave up waiting for a free slot")
+        if not admitted:
+            self.record_timeout(ticket)
+            raise QueueTimeoutError(f"Waited more than {self.max_wait:.0f}s for a free slot")
+        return ticket
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE, timeout=None, client=None, cost=1):
+        ticket = self.admit(priority, timeout, client, cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def record_timeout(self, ticket):
+        """Withdraw a ticket whose caller gave up waiting"""
+        self.release(ticket)
+        with self._cond:
+            self.timed_out += 1
+
+    def _admit(self, ticket):
+        ticket.state = 'admitted'
+        ticket.admitted_at = time.monotonic()
+        state = self._clients[ticket.client]
+        state.active += 1
+        state.active_cost += ticket.cost
+        self._virtual_time[ticket.priority] = max(self._virtual_time.get(ticket.priority, 0.0), ticket.finish)
+        self._active += 1
+        self.admitted += 1
+        self.total_wait += ticket.wait_time
+
+    def _forget_idle(self, client):
+        # An idle client's clock has fallen behind the virtual time anyway
+        state = self._clients[client]
+        if not state.active and not state.waiting:
+            del self._clients[client]
+
+    def _next_waiting(self):
+        """Pop the first ticket whose client is under max_per_client, or the first ticket if none is"""
+        skipped = []
+        ticket = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if self._clients[entry[1].client].active < self.max_per_client:
+                ticket = entry[1]
+                break
+            skipped.append(entry)
+        if ticket is None:
+            ticket = skipped.pop(0)[1]
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return ticket
+
+    def _admit_waiting(self):
+        while self._active < self.max_concurrent and self._heap:
+            ticket = self._next_waiting()
+            self._clients[ticket.client].waiting -= 1
+            self._admit(ticket)
+        self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": len(self._heap),
+                "waiting_interactive": sum(1 for _, ticket in self._heap if ticket.priority == PRIORITY_INTERACTIVE),
+                "waiting_bulk": sum(1 for _, ticket in self._heap if ticket.priority == PRIORITY_BULK),
+                "clients": len(self._clients),
+                "max_concurrent": self.max_concurrent,
+                "max_depth": self.max_depth,
+                "max_wait": self.max_wait,
+                "max_per_client": self.max_per_client,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "cancelled": self.cancelled,
+                "average_wait": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0
+            }
+
+def parse_weights(value):
+    """Parse 'client=weight,...' (e.g. '10.0.0.5=4,10.0.0.6=0.5') into a dict"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        client, _, weight = item.rpartition('=')
+        if not client or float(weight) <= 0:
+            raise ValueError(f"Invalid QUEUE_CLIENT_WEIGHTS entry: {item}")
+        weights[client] = float(weight)
+    return weights
+
+def create_admission_queue():
+    """Build the queue configured by the QUEUE_* environment variables"""
+    return AdmissionQueue(
+        max_concurrent=int(os.environ.get('QUEUE_MAX_CONCURRENT', 4)),
+        max_depth=int(os.environ.get('QUEUE_MAX_DEPTH', 32)),
+        max_wait=float(os.environ.get('QUEUE_MAX_WAIT', 60)),
+        max_per_client=int(os.environ.get('QUEUE_MAX_PER_CLIENT', 0)) or None,
+        weights=parse_weights(os.environ.get('QUEUE_CLIENT_WEIGHTS'))
+    )
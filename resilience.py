@@ -0,0 +1,229 @@
+"""Protection against a slow or unavailable Ollama backend.
+
+CircuitBreaker stops sending requests after repeated failures and fails
+fast until a cool-down passes, then lets a single probe through (half-open)
+to decide whether to close again. Its state can live in a sqlite file so
+every gunicorn worker on a host trips and recovers together.
+
+LatencyTracker derives request timeouts from recently observed latencies
+instead of a fixed 120 s, and RetryBudget caps retries to a fraction of
+overall traffic so retries cannot multiply load during an outage.
+"""
+import os
+import time
+import sqlite3
+from threading import Lock
+from collections import deque
+from contextlib import contextmanager
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    def __init__(self, name='ollama', failure_threshold=5, reset_timeout=30.0, state_path=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state_path = state_path
+        self._lock = Lock()
+        self.rejected = 0
+        if state_path:
+            self._conn = sqlite3.connect(state_path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS breakers ("
+                "name TEXT PRIMARY KEY, state TEXT NOT NULL, failures INTEGER NOT NULL, "
+                "opened_at REAL NOT NULL, probe_started_at REAL NOT NULL)"
+            )
+        else:
+            self._conn = None
+            self._state = self._initial_state()
+
+    @staticmethod
+    def _initial_state():
+        return {"state": CLOSED, "failures": 0, "opened_at": 0.0, "probe_started_at": 0.0}
+
+    @contextmanager
+    def _transaction(self):
+        """Yield the breaker state as a dict; changes are saved on exit"""
+        with self._lock:
+            if self._conn is None:
+                yield self._state
+                return
+            # BEGIN IMMEDIATE serializes the read-modify-write across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT state, failures, opened_at, probe_started_at FROM breakers WHERE name = ?",
+                    (self.name,)
+                ).fetchone()
+                state = self._initial_state() if row is None else dict(
+                    zip(("state", "failures", "opened_at", "probe_started_at"), row)
+                )
+                yield state
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO breakers VALUES (?, ?, ?, ?, ?)",
+                    (self.name, state["state"], state["failures"], state["opened_at"], state["probe_started_at"])
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def allow(self):
+        """Whether a request may be sent now; False means fail fast"""
+        now = time.time()
+        with self._transaction() as state:
+            if state["state"] == OPEN and now - state["opened_at"] >= self.reset_timeout:
+                state["state"] = HALF_OPEN
+                state["probe_started_at"] = 0.0
+            if state["state"] == CLOSED:
+                return True
+            # Half-open lets one probe through at a time; a probe that never
+            # reported back is replaced after reset_timeout
+            if state["state"] == HALF_OPEN and now - state["probe_started_at"] >= self.reset_timeout:
+                state["probe_started_at"] = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._transaction() as state:
+            state.update(self._initial_state())
+
+    def record_failure(self):
+        now = time.time()
+        with self._transaction() as state:
+            state["failures"] += 1
+            if state["state"] == HALF_OPEN or state["failures"] >= self.failure_threshold:
+                state["state"] = OPEN
+                state["opened_at"] = now
+
+    @property
+    def state(self):
+        with self._transaction() as state:
+            if state["state"] == OPEN and time.time() - state["opened_at"] >= self.reset_timeout:
+                return HALF_OPEN
+            return state["state"]
+
+    def stats(self):
+        with self._transaction() as state:
+            failures = state["failures"]
+        return {
+            "state": self.state,
+            "consecutive_failures": failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+            "rejected": self.rejected,
+            "shared": self.state_path is not None
+        }
+
+class LatencyTracker:
+    """Rolling window of latencies used to derive an adaptive timeout"""
+
+    def __init__(self, window=200, percentile=99, multiplier=2.0, min_timeout=10.0,
+                 max_timeout=120.0, min_samples=20):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, percentile):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def timeout(self):
+        """multiplier x the chosen percentile, clamped; max_timeout until enough samples exist"""
+        with self._lock:
+            enough = len(self._samples) >= self.min_samples
+        if not enough:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, self.quantile(self.percentile) * self.multiplier))
+
+    def stats(self):
+        return {
+            "samples": len(self._samples),
+            "p50": self.quantile(50),
+            "p95": self.quantile(95),
+            "p99": self.quantile(99),
+            "timeout": self.timeout()
+        }
+
+class RetryBudget:
+    """Allow retries only up to `ratio` of requests in a sliding window,
+    plus a small floor so an idle service can still retry"""
+
+    def __init__(self, ratio=0.2, min_retries_per_second=0.5, window=10.0):
+        self.ratio = ratio
+        self.min_retries_per_second = min_retries_per_second
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = Lock()
+        self.exhausted = 0
+
+    def _prune(self, now):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._requests.append(now)
+
+    def try_retry(self):
+        """Spend budget on a retry; returns False when retrying would exceed the budget"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            allowed = len(self._requests) * self.ratio + self.min_retries_per_second * self.window
+            if len(self._retries) >= allowed:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            return {
+                "requests_in_window": len(self._requests),
+                "retries_in_window": len(self._retries),
+                "ratio": self.ratio,
+                "exhausted": self.exhausted
+            }
+
+def create_circuit_breaker(name='ollama'):
+    """Build a breaker configured by BREAKER_*; BREAKER_STATE_PATH shares it between workers"""
+    return CircuitBreaker(
+        name,
+        failure_threshold=int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5)),
+        reset_timeout=float(os.environ.get('BREAKER_RESET_TIMEOUT', 30)),
+        state_path=os.environ.get('BREAKER_STATE_PATH') or None
+    )
+
+def create_latency_tracker():
+    """Build a tracker configured by the TIMEOUT_* environment variables"""
+    return LatencyTracker(
+        percentile=float(os.environ.get('TIMEOUT_PERCENTILE', 99)),
+        multiplier=float(os.environ.get('TIMEOUT_MULTIPLIER', 2)),
+        min_timeout=float(os.environ.get('TIMEOUT_MIN', 10)),
+        max_timeout=float(os.environ.get('TIMEOUT_MAX', 120))
+    )
+
+def create_retry_budget():
+    return RetryBudget(ratio=float(os.environ.get('RETRY_BUDGET_RATIO', 0.2)))
@@ -0,0 +1,199 @@
+"""Response cache placed in front of Ollama generations.
+
+Entries are keyed on the normalized prompt plus the model options it was
+generated with, so a change of model or sampling settings never serves a
+stale answer. Two interchangeable backends are provided: an in-memory LRU
+with TTL, and a sqlite file that survives restarts and can be shared by
+several worker processes.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+def normalize_prompt(prompt):
+    """Collapse case and whitespace so trivially different prompts share an entry"""
+    return WHITESPACE_RE.sub(' ', prompt).strip().casefold()
+
+def make_cache_key(payload):
+    """Build a cache key from an Ollama generate payload, ignoring settings that don't change the answer"""
+    options = {k: v for k, v in payload.items() if k not in ('prompt', 'stream', 'keep_alive')}
+    material = json.dumps(
+        {"prompt": normalize_prompt(payload.get('prompt', '')), "options": options},
+        sort_keys=True
+    )
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """Base class holding the hit/miss/eviction counters shared by all backends"""
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __contains__(self, key):
+        """Whether a live entry exists, without touching counters or recency"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "size": len(self),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class LRUCache(ResponseCache):
+    """Thread-safe in-memory LRU cache with per-entry TTL"""
+
+    def __init__(self, max_size=1024, ttl=3600):
+        super().__init__(max_size, ttl)
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] >= time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+class SqliteCache(ResponseCache):
+    """On-disk cache that survives restarts; least recently used entries are evicted first"""
+
+    def __init__(self, path='response_cache.sqlite3', max_size=10000, ttl=86400):
+        super().__init__(max_size, ttl)
+        self.path = path
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now)
+            )
+            overflow = self._count() - self.max_size
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (overflow,)
+                )
+                self.evictions += overflow
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def __contains__(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM responses WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row is not None
+
+    def _count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+def create_cache():
+    """Build the cache configured by the RESPONSE_CACHE_* environment variables"""
+    backend = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory').lower()
+    max_size = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+    ttl = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+
+    if backend in ('none', 'off', ''):
+        return None
+    if backend == 'sqlite':
+        path = os.environ.get('RESPONSE_CACHE_PATH', 'response_cache.sqlite3')
+        return SqliteCache(path, max_size, ttl)
+    if backend == 'memory':
+        return LRUCache(max_size, ttl)
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {backend}")
@@ -0,0 +1,220 @@
+"""Answer paraphrased questions from cache.
+
+The exact response cache only matches prompts that normalize to the same
+text, so "reverse a list in python" and "how do I reverse python list" are
+two misses. SemanticCache embeds each question, keeps the vectors in a
+NumPy matrix and serves the stored answer of the nearest earlier question
+when their cosine similarity reaches `threshold`. Entries expire after
+`ttl`, and once `max_size` is reached the least recently used is replaced.
+
+Questions are embedded either locally with hashed words and word pairs (no
+model needed, matches rewordings of the same keywords) or with an Ollama
+embedding model (also matches synonyms, costs a request per lookup).
+Requires the optional numpy package.
+"""
+import os
+import re
+import time
+import zlib
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:  # The semantic cache is optional
+    np = None
+
+import ollama_client
+
+WORD_RE = re.compile(r"[a-z0-9+#]+")
+# Words that change the phrasing of a coding question but not what it asks for
+STOP_WORDS = frozenset("""
+a an the i me my we you your it its of in on for with and or is are be do does did can could
+would should will how what which way write show give tell please using use make get some
+by at this that these those there here as so just about want need like program code
+""".split())
+# Words that give the words around them a direction: "int to string" is not "string to int"
+DIRECTION_WORDS = frozenset(('to', 'from', 'into', 'than', 'without', 'not'))
+PAIR_WEIGHT = 0.3            # Adjacent keywords, so order counts without undoing rewordings
+DIRECTION_PAIR_WEIGHT = 1.0  # A pair with a direction word decides what is asked
+
+class HashingEmbedder:
+    """Words and adjacent word pairs hashed into a fixed-size vector, with light suffix stripping.
+
+    Filler words are ignored and pairs weigh little, so rewordings of the
+    same keywords land on nearly the same vector; pairs with a direction
+    word weigh as much as a word, so swapping what is converted to what
+    moves it well away.
+    """
+
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+
+    @staticmethod
+    def _stem(word):
+        # Crude, but enough for "reverse"/"reversing"/"reversed" and "list"/"lists" to agree
+        for suffix in ('ing', 'ed', 'es', 's'):
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                word = word[:-len(suffix)]
+                break
+        return word[:-1] if word.endswith('e') and len(word) > 3 else word
+
+    def features(self, text):
+        """(feature, weight) pairs: each keyword, then each pair of adjacent keywords"""
+        words = []
+        for word in WORD_RE.findall(text.lower()):
+            if word in DIRECTION_WORDS:
+                if words and words[-1] not in DIRECTION_WORDS:  # "how to ..." has no direction
+                    words.append(word)
+            elif word not in STOP_WORDS:
+                words.append(self._stem(word))
+        features = [(word, 1.0) for word in words if word not in DIRECTION_WORDS]
+        for first, second in zip(words, words[1:]):
+            directed = first in DIRECTION_WORDS or second in DIRECTION_WORDS
+            features.append((f"{first} {second}", DIRECTION_PAIR_WEIGHT if directed else PAIR_WEIGHT))
+        return features
+
+    def embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, weight in self.features(text):
+            digest = zlib.crc32(feature.encode('utf-8'))
+            # The hash's top bit picks the sign, so collisions tend to cancel out
+            vector[digest % self.dimensions] += weight if digest & 0x80000000 else -weight
+        return vector
+
+class OllamaEmbedder:
+    """Embeddings from an Ollama embedding model such as nomic-embed-text"""
+
+    def __init__(self, model='nomic-embed-text', timeout=10):
+        self.model = model
+        self.timeout = timeout
+
+    def embed(self, text):
+        return np.asarray(ollama_client.post_embeddings(self.model, text, timeout=self.timeout), dtype=np.float32)
+
+class SemanticCache:
+    def __init__(self, embedder, max_size=1024, ttl=3600, threshold=0.9):
+        if np is None:
+            raise RuntimeError("The semantic cache requires numpy (pip install numpy)")
+        self.embedder = embedder
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = Lock()
+        # One row per entry. Vectors are unit length so a dot product is the cosine
+        # similarity; the matrix is allocated on the first add, once the size is known
+        self._vectors = None
+        self._answers = [None] * max_size
+        self._namespaces = np.full(max_size, -1, dtype=np.int32)  # -1 marks a free row
+        self._expires_at = np.zeros(max_size)
+        self._last_used = np.zeros(max_size)
+        self._namespace_ids = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _embed(self, text):
+        vector = self.embedder.embed(text)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else None
+
+    def get(self, question, namespace=''):
+        """Return (answer, similarity) of the closest cached question, or (None, best similarity).
+
+        namespace separates answers generated with different model settings.
+        """
+        vector = self._embed(question)
+        now = time.time()
+        with self._lock:
+            row, score = self._nearest(vector, namespace, now)
+            if row is None or score < self.threshold:
+                self.misses += 1
+                return None, score
+            self._last_used[row] = now
+            self.hits += 1
+            return self._answers[row], score
+
+    def _nearest(self, vector, namespace, now):
+        namespace_id = self._namespace_ids.get(namespace)
+        if vector is None or namespace_id is None:
+            return None, 0.0
+        live = self._namespaces == namespace_id
+        expired = live & (self._expires_at < now)
+        if expired.any():
+            self._remove(expired)
+            self.expirations += int(expired.sum())
+            live &= ~expired
+        if not live.any():
+            return None, 0.0
+        scores = np.where(live, self._vectors @ vector, -np.inf)
+        row = int(np.argmax(scores))
+        return row, float(scores[row])
+
+    def set(self, question, answer, namespace=''):
+        vector = self._embed(question)
+        if vector is None:
+            return  # Nothing but filler words; it would match every other such question
+        now = time.time()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            namespace_id = self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+            row, score = self._nearest(vector, namespace, now)
+            if row is None or score < 0.999:  # Otherwise the same question again: refresh it in place
+                free = np.flatnonzero(self._namespaces < 0)
+                if len(free):
+                    row = int(free[0])
+                else:
+                    row = int(np.argmin(self._last_used))
+                    self.evictions += 1
+            self._vectors[row] = vector
+            self._answers[row] = answer
+            self._namespaces[row] = namespace_id
+            self._expires_at[row] = now + self.ttl
+            self._last_used[row] = now
+
+    def _remove(self, mask):
+        self._namespaces[mask] = -1
+        self._last_used[mask] = 0.0
+        for row in np.flatnonzero(mask):
+            self._answers[row] = None
+
+    def clear(self):
+        with self._lock:
+            self._remove(np.ones(self.max_size, dtype=bool))
+
+    def __len__(self):
+        return int((self._namespaces >= 0).sum())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "embedder": type(self.embedder).__name__,
+            "size": len(self),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+def create_semantic_cache():
+    """Build the cache configured by the SEMANTIC_CACHE* environment variables, or None when disabled"""
+    embedder = os.environ.get('SEMANTIC_CACHE', 'off').lower()
+    if embedder in ('off', 'none', ''):
+        return None
+    if embedder == 'local':
+        embedder = HashingEmbedder()
+    elif embedder == 'ollama':
+        embedder = OllamaEmbedder(os.environ.get('SEMANTIC_CACHE_MODEL', 'nomic-embed-text'))
+    else:
+        raise ValueError(f"Unknown SEMANTIC_CACHE embedder: {embedder}")
+    return SemanticCache(
+        embedder,
+        max_size=int(os.environ.get('SEMANTIC_CACHE_SIZE', 1024)),
+        ttl=float(os.environ.get('SEMANTIC_CACHE_TTL', 3600)),
+        threshold=float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.9))
+    )
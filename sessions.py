@@ -0,0 +1,128 @@
+"""Server-side conversation state so follow-up questions keep their context.
+
+A session stores the `context` token array Ollama returns from
+/api/generate; sending it back with the next prompt lets the model continue
+the conversation without re-reading it. Prefill stays bounded: once the
+context grows past `max_context_tokens` it is dropped, and the next turn is
+instead prefixed with a condensed transcript of the last few turns.
+Idle sessions are evicted, and the store holds at most `max_sessions`.
+
+Only follow-ups that seem to refer back to the conversation are answered
+with its history; a self-contained question in the same session is
+answered like any other message, from the caches.
+"""
+import os
+import re
+import time
+import secrets
+from threading import Lock
+from collections import OrderedDict, deque
+
+def _truncate(text, max_chars):
+    text = ' '.join(text.split())
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + '...'
+
+# Words and openings that point back at earlier turns; very short messages ("and in Go?") count too
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|this|that|these|those|them|above|previous|earlier|again|also|instead|same|another|"
+    r"more|else|rather|last|before)\b|^\s*(and|but|or|so|what about|how about)\b",
+    re.IGNORECASE
+)
+FOLLOW_UP_MAX_WORDS = 4
+
+def refers_back(message):
+    """Whether a message probably depends on the turns before it"""
+    return len(message.split()) <= FOLLOW_UP_MAX_WORDS or bool(FOLLOW_UP_PATTERN.search(message))
+
+class ConversationSession:
+    def __init__(self, max_context_tokens=1024, max_turns=4, max_turn_chars=300):
+        self.max_context_tokens = max_context_tokens
+        self.max_turn_chars = max_turn_chars
+        self.context = None
+        self.turns = deque(maxlen=max_turns)
+        self.last_used = time.monotonic()
+
+    def has_history(self):
+        return bool(self.context) or bool(self.turns)
+
+    def transcript(self):
+        """Condensed transcript of recent turns, to prefix the next prompt with ('' before the first turn)"""
+        if not self.turns:
+            return ''
+        transcript = '\n'.join(f"User: {user}\nAssistant: {assistant}" for user, assistant in self.turns)
+        return f"Conversation so far (condensed):\n{transcript}\n\n"
+
+    def build_prompt(self, prompt):
+        """The prompt to send: unchanged when the context carries the conversation,
+        otherwise prefixed with a condensed transcript of recent turns"""
+        if self.context:
+            return prompt
+        return self.transcript() + prompt
+
+    def record_turn(self, user_message, response, context=None):
+        self.turns.append((
+            _truncate(user_message, self.max_turn_chars),
+            _truncate(response, self.max_turn_chars)
+        ))
+        # Past the cap, re-prefilling the whole context would cost more than the transcript
+        if context and len(context) <= self.max_context_tokens:
+            self.context = context
+        else:
+            self.context = None
+        self.last_used = time.monotonic()
+
+class SessionStore:
+    def __init__(self, max_sessions=1000, idle_timeout=1800, **session_options):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.session_options = session_options
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+        self.evictions = 0
+
+    def get(self, session_id=None):
+        """Return (session_id, session), starting a new session for unknown or missing ids"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session_id = secrets.token_urlsafe(16)
+                session = self._sessions[session_id] = ConversationSession(**self.session_options)
+            self._sessions.move_to_end(session_id)
+            session.last_used = now
+            self._evict(now)
+            return session_id, session
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used < self.idle_timeout and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "with_context": sum(1 for session in self._sessions.values() if session.context),
+                "evictions": self.evictions
+            }
+
+def session_options_from_env():
+    return {
+        "max_context_tokens": int(os.environ.get('SESSION_MAX_CONTEXT_TOKENS', 1024)),
+        "max_turns": int(os.environ.get('SESSION_MAX_TURNS', 4)),
+        "max_turn_chars": int(os.environ.get('SESSION_MAX_TURN_CHARS', 300))
+    }
+
+def create_session_store():
+    """Build the store configured by the SESSION_* environment variables"""
+    return SessionStore(
+        max_sessions=int(os.environ.get('SESSION_MAX_SESSIONS', 1000)),
+        idle_timeout=float(os.environ.get('SESSION_IDLE_TIMEOUT', 1800)),
+        **session_options_from_env()
+    )
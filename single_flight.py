@@ -0,0 +1,189 @@
+"""Single-flight deduplication of concurrent identical generations.
+
+When several requests ask for the same thing at the same time, only the
+first (the leader) calls Ollama; the others wait for and share its result,
+or its error. Streaming subscribers share one upstream stream and receive
+every token from the beginning, however late they join.
+
+A shared call is only abandoned once every caller has given up on it: a
+stream when its last subscriber goes away, a plain call when each caller
+passed a cancel_event and all of them have been set.
+
+Work moved to a background thread runs in a copy of the leader's
+contextvars context, so request-scoped state such as Flask's request
+context, and the stage timings and log fields read from it, follows it.
+"""
+import contextvars
+from threading import Lock, Condition, Event, Thread
+
+CANCEL_POLL_INTERVAL = 0.1  # Seconds between checks of a waiting caller's cancel_event
+
+class CancelledError(Exception):
+    """Raised to a caller of SingleFlight.do whose cancel_event was set before the result came"""
+
+class _Call:
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+        self.cancel = Event()   # Set once nobody is waiting for the result any more
+        self.waiting = 0        # Cancellable callers still interested in the result
+        self.pinned = False     # A caller without a cancel_event always wants the result
+
+class _StreamCall:
+    def __init__(self):
+        self.cond = Condition()
+        self.items = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.cancelled = False
+
+class SingleFlight:
+    """Group of in-flight calls keyed by request identity"""
+
+    def __init__(self, name='single-flight'):
+        self.name = name
+        self._lock = Lock()
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, cancel_event=None, **kwargs):
+        """Run fn once per key at a time; concurrent callers get the same result.
+
+        A caller passing cancel_event stops waiting with CancelledError once it
+        is set. If the leader passed one, fn runs on a background thread and
+        receives a cancel_event keyword argument of its own, which is set when
+        every caller has given up, so it can stop early.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+            if cancel_event is None:
+                call.pinned = True
+            else:
+                call.waiting += 1
+
+        if leader and cancel_event is None:
+            self._run(key, call, fn, args, kwargs)
+        elif leader:
+            Thread(target=contextvars.copy_context().run,
+                   args=(self._run, key, call, fn, args, dict(kwargs, cancel_event=call.cancel)),
+                   daemon=True, name=f"{self.name}-call").start()
+
+        if cancel_event is None:
+            call.event.wait()
+        else:
+            while not call.event.wait(CANCEL_POLL_INTERVAL):
+                if cancel_event.is_set():
+                    self._abandon(key, call)
+                    raise CancelledError()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _run(self, key, call, fn, args, kwargs):
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.event.set()
+
+    def _abandon(self, key, call):
+        with self._lock:
+            call.waiting -= 1
+            if call.waiting <= 0 and not call.pinned and not call.event.is_set():
+                call.cancel.set()
+                # New callers start a fresh call rather than joining a cancelled one
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def stream(self, key, factory):
+        """Return a generator over the items of a shared stream.
+
+        The first subscriber for a key starts factory() on a background thread;
+        later subscribers replay what has been produced so far and then follow
+        along. If every subscriber goes away the upstream generator is closed.
+        """
+        with self._lock:
+            call = self._streams.get(key)
+            if call is None:
+                call = self._streams[key] = _StreamCall()
+                self.leaders += 1
+                Thread(target=contextvars.copy_context().run, args=(self._pump, key, call, factory),
+                       daemon=True, name=f"{self.name}-pump").start()
+            else:
+                self.coalesced += 1
+            call.subscribers += 1
+        return self._subscribe(key, call)
+
+    def _pump(self, key, call, factory):
+        error = None
+        generator = factory()
+        try:
+            for item in generator:
+                with call.cond:
+                    if call.cancelled:
+                        break
+                    call.items.append(item)
+                    call.cond.notify_all()
+        except BaseException as e:
+            error = e
+        finally:
+            generator.close()
+            with self._lock:
+                if self._streams.get(key) is call:
+                    del self._streams[key]
+            with call.cond:
+                call.done = True
+                call.error = error
+                call.cond.notify_all()
+
+    def _subscribe(self, key, call):
+        index = 0
+        try:
+            while True:
+                with call.cond:
+                    while index >= len(call.items) and not call.done:
+                        call.cond.wait()
+                    items = call.items[index:]
+                    index += len(items)
+                    finished = call.done and index >= len(call.items)
+                    error = call.error
+                yield from items
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._unsubscribe(key, call)
+
+    def _unsubscribe(self, key, call):
+        with self._lock:
+            call.subscribers -= 1
+            if call.subscribers == 0 and not call.done:
+                # Nobody is listening any more: stop the upstream generation and
+                # make sure new callers start a fresh stream instead of joining it
+                call.cancelled = True
+                if self._streams.get(key) is call:
+                    del self._streams[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._streams),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced
+            }
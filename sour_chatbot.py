@@ -1,77 +1,210 @@
+import argparse
+import json
 import requests
 import sys
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
+
+import ollama_client
+from sessions import ConversationSession, session_options_from_env
+from model_routing import KeywordClassifier
+from prompt_templates import template_for
+
+MAX_RETRIES = 3
+MIN_BACKOFF = 1  # seconds
+CUT_SHORT = "Answer cut short"
+# Seconds to connect, then seconds allowed between streamed chunks; a long answer
+# is fine as long as tokens keep arriving
+STREAM_TIMEOUT = (5, 60)
+
+class PartialResponseError(Exception):
+    """Generation failed after some of the answer was already received"""
+
+    def __init__(self, message, text):
+        super().__init__(message)
+        self.text = text
+
+classify = KeywordClassifier()
+
+def build_payload(prompt, context=None, template=None):
+    payload = {
+        "model": "codellama",
+        "prompt": prompt,
+        "stream": True,
+        "context_window": 512,   # Minimal context for faster response
+        "num_predict": 128,      # Minimal prediction for faster response
+        "temperature": 0.2,      # Very focused responses
+        "top_p": 1.0,           # Use all tokens for better quality
+        "repeat_penalty": 1.5    # Strong repetition prevention
+    }
+    if context:
+        payload["context"] = context  # Already holds the instructions sent with the first turn
+    elif template:
+        template.apply(payload)
+    return payload
+
+def templated(message):
+    """(prompt, template) for a message, with the instructions its kind of question gets"""
+    template = template_for(classify(message))
+    return template.render(message), template
+
+def stream_generate(payload, on_token=None):
+    """Stream a generation from Ollama, calling on_token with each piece; returns (text, context).
+
+    Closing the response on any exit, including KeyboardInterrupt, drops the
+    connection so Ollama stops generating.
+    """
+    pieces = []
+    with ollama_client.post_generate(payload, stream=True, timeout=STREAM_TIMEOUT) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"Received status code {response.status_code}")
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise RuntimeError(chunk['error'])
+                token = chunk.get('response', '')
+                if token:
+                    pieces.append(token)
+                    if on_token:
+                        on_token(token)
+                if chunk.get('done'):
+                    return ''.join(pieces), chunk.get('context')
+        except (requests.exceptions.RequestException, RuntimeError, ValueError) as e:
+            if pieces:
+                raise PartialResponseError(str(e), ''.join(pieces))
+            raise
+    raise PartialResponseError("Stream ended before the answer was complete", ''.join(pieces))
+
+def describe_error(error):
+    if isinstance(error, requests.exceptions.Timeout):
+        return "Request timed out. Please try again."
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return "Could not connect to Ollama. Please make sure Ollama is running with CodeLlama model."
+    return str(error)
+
+def generate_with_retry(payload, on_token=None, on_error=None):
+    """Return (text, context), retrying with backoff while nothing has been received.
+
+    Once tokens have arrived a failure is not retried, since that would
+    throw away what was already generated; the partial text is returned
+    with context None.
+    """
+    backoff_time = MIN_BACKOFF
+    last_error = None
+    for attempt in range(MAX_RETRIES):
+        try:
+            return stream_generate(payload, on_token)
+        except PartialResponseError as e:
+            if on_error:
+                on_error(f"{CUT_SHORT}: {e}")
+            return e.text, None
+        except Exception as e:
+            last_error = describe_error(e)
+            if on_error:
+                on_error(last_error)
+        if attempt < MAX_RETRIES - 1:
+            time.sleep(backoff_time + random.uniform(0, 0.2))
+            backoff_time *= 2
+    raise RuntimeError(f"Failed after {MAX_RETRIES} attempts. Last error: {last_error}")
 
 def chat_with_sour():
     """Main function to interact with SOUR chatbot"""
-    print("\\n🤖 SOUR: Hello! I'm SOUR, your coding assistant powered by CodeLlama.")
-    print("Type 'exit' to end the conversation.\\n")
+    print("\n🤖 SOUR: Hello! I'm SOUR, your coding assistant powered by CodeLlama.")
+    print("Type 'exit' to end the conversation. Press Ctrl-C to stop an answer.\n")
+
+    session = ConversationSession(**session_options_from_env())  # Carries context between turns
+
+    def print_token(token):
+        print(token, end='', flush=True)
 
-    max_retries = 3
-    min_backoff = 1  # seconds
+    def print_error(message):
+        print(f"\n❌ Error: {message}")
 
     while True:
         try:
             # Get user input
             user_input = input("👤 You: ").strip()
-            
-            if user_input.lower() in ['exit', 'quit']:
-                print("\\n🤖 SOUR: Goodbye! Have a great day!")
-                break
-                
-            if not user_input:
-                print("🤖 SOUR: Please type something!")
-                continue
-
-            last_error = None
-            backoff_time = min_backoff
-
-            for attempt in range(max_retries):
-                try:
-                    # Send request to Ollama
-                    response = requests.post(
-                        "http://localhost:11434/api/generate",
-                        json={
-                            "model": "codellama",
-                            "prompt": user_input,
-                            "stream": False,
-                            "context_window": 512,   # Minimal context for faster response
-                            "num_predict": 128,      # Minimal prediction for faster response
-                            "temperature": 0.2,      # Very focused responses
-                            "top_p": 1.0,           # Use all tokens for better quality
-                            "repeat_penalty": 1.5    # Strong repetition prevention
-                        },
-                        timeout=15
-                    )
-
-                    if response.status_code == 200:
-                        result = response.json()
-                        print(f"\\n🤖 SOUR: {result['response']}\\n")
-                        break
-                    else:
-                        last_error = f"Received status code {response.status_code}"
-                        print(f"\\n❌ Error: {last_error}")
-                except requests.exceptions.Timeout:
-                    last_error = "Request timed out. Please try again."
-                    print(f"\\n❌ Error: {last_error}")
-                except requests.exceptions.ConnectionError:
-                    last_error = "Could not connect to Ollama. Please make sure Ollama is running with CodeLlama model."
-                    print(f"\\n❌ Error: {last_error}")
-                except Exception as e:
-                    last_error = str(e)
-                    print(f"\\n❌ Error: {last_error}")
-
-                if attempt < max_retries - 1:
-                    jitter = random.uniform(0, 0.2)
-                    time.sleep(backoff_time + jitter)
-                    backoff_time *= 2
-                else:
-                    print(f"\\n❌ Failed after {max_retries} attempts. Last error: {last_error}")
+        except (KeyboardInterrupt, EOFError):
+            print("\n\n🤖 SOUR: Goodbye! Have a great day!")
+            break
 
-        except KeyboardInterrupt:
-            print("\\n\\n🤖 SOUR: Goodbye! Have a great day!")
+        if user_input.lower() in ['exit', 'quit']:
+            print("\n🤖 SOUR: Goodbye! Have a great day!")
             break
 
-if __name__ == "__main__":
+        if not user_input:
+            print("🤖 SOUR: Please type something!")
+            continue
+
+        print("\n🤖 SOUR: ", end='', flush=True)
+        prompt, template = templated(user_input)
+        try:
+            text, context = generate_with_retry(
+                build_payload(session.build_prompt(prompt), session.context, template), print_token, print_error
+            )
+            print("\n")
+            session.record_turn(user_input, text, context)
+        except KeyboardInterrupt:
+            # Only this answer is cancelled; the conversation carries on without it
+            print("\n[cancelled]\n")
+        except RuntimeError as e:
+            print(f"\n❌ {e}\n")
+
+def answer_prompt(prompt):
+    """Answer one prompt on its own, for pipe mode; returns (text, error)"""
+    errors = []
+    prompt, template = templated(prompt)
+    try:
+        text, _ = generate_with_retry(build_payload(prompt, template=template), on_error=errors.append)
+    except RuntimeError as e:
+        return None, str(e)
+    # Failed attempts before one that succeeded don't concern the answer; a cut-short answer,
+    # which is never retried, is the only one that comes with its error
+    return text, errors[-1] if errors and errors[-1].startswith(CUT_SHORT) else None
+
+def run_pipe(concurrency=4, jsonl=False):
+    """Answer each non-empty stdin line and write the answers to stdout in input order.
+
+    Returns the process exit status: 0 when every prompt was answered.
+    """
+    prompts = [line.strip() for line in sys.stdin if line.strip()]
+    failed = 0
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for index, (prompt, (text, error)) in enumerate(zip(prompts, executor.map(answer_prompt, prompts))):
+            if text is None:
+                failed += 1
+                print(f"Prompt {index + 1} failed: {error}", file=sys.stderr)
+            if jsonl:
+                record = {"index": index, "prompt": prompt, "response": text}
+                if error:
+                    record["error"] = error
+                print(json.dumps(record), flush=True)
+            elif text is not None:
+                print(text.strip() + "\n", flush=True)
+    finally:
+        # On Ctrl-C, drop the prompts not started yet instead of answering them all first
+        executor.shutdown(wait=False, cancel_futures=True)
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat with SOUR, or answer prompts from stdin in pipe mode")
+    parser.add_argument('--pipe', action='store_true',
+                        help='Read one prompt per line from stdin and print the answers (the default when stdin is not a terminal)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Prompts answered at once in pipe mode')
+    parser.add_argument('--jsonl', action='store_true', help='In pipe mode, print one JSON object per answer')
+    args = parser.parse_args()
+
+    if args.pipe or not sys.stdin.isatty():
+        try:
+            sys.exit(run_pipe(max(1, args.concurrency), args.jsonl))
+        except KeyboardInterrupt:
+            sys.exit(130)
     chat_with_sour()
+
+if __name__ == "__main__":
+    main()
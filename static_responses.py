@@ -0,0 +1,70 @@
+"""Responses whose bodies never change while the process runs, prepared once.
+
+The serverless entry point answers with the same few bodies over and over:
+the chat page and the canned answers used when no Ollama server is
+reachable. Each is rendered, formatted and compressed (gzip, plus brotli
+when the optional `brotli` package is installed) at import time, so a
+request only picks the encoding the client accepts. Every representation
+carries an ETag, so a client or CDN revalidating a GET with If-None-Match
+gets an empty 304, and Cache-Control lets shared caches keep GET responses.
+"""
+import gzip
+import hashlib
+from types import MappingProxyType
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # Brotli bodies are optional; gzip is always available
+    brotli = None
+
+COMPRESS_MIN_BYTES = 256  # Smaller bodies gain less than the encoding header costs
+
+class StaticResponse:
+    def __init__(self, body, content_type, cache_control):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.cache_control = cache_control
+        tag = hashlib.sha256(body).hexdigest()[:20]
+        self.bodies = {'identity': body}
+        if len(body) >= COMPRESS_MIN_BYTES:
+            self.bodies['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body)
+        # Each encoding is a different representation, so each gets its own strong ETag
+        self.etags = {
+            encoding: tag if encoding == 'identity' else f'{tag}-{encoding}' for encoding in self.bodies
+        }
+
+    def encoding_for(self, request):
+        """The smallest encoding the client accepts"""
+        accepted = [
+            encoding for encoding in self.bodies
+            if encoding == 'identity' or request.accept_encodings[encoding]
+        ]
+        return min(accepted, key=lambda encoding: len(self.bodies[encoding]))
+
+    def respond(self, request):
+        encoding = self.encoding_for(request)
+        headers = {
+            'ETag': f'"{self.etags[encoding]}"',
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        # Any encoding of the same body is still fresh for the client. Only reads revalidate:
+        # a POST answered with 304 would look to the client like an empty reply
+        if request.method in ('GET', 'HEAD') and any(
+            request.if_none_match.contains(etag) for etag in self.etags.values()
+        ):
+            return Response(status=304, headers=headers)
+        return Response(self.bodies[encoding], content_type=self.content_type, headers=headers)
+
+def precompute(bodies, content_type, cache_control='no-cache'):
+    """Read-only mapping of name to StaticResponse for each body"""
+    return MappingProxyType({
+        name: StaticResponse(body, content_type, cache_control) for name, body in bodies.items()
+    })
@@ -0,0 +1,178 @@
+"""Logging that stays off the request path.
+
+Request threads only put records on a bounded queue; one listener thread
+formats and writes them, so a slow stdout or log collector never blocks a
+request. When the queue is full, records are dropped and counted rather
+than waited for.
+
+Records are JSON objects, one per line. Structured details go in
+`extra=log_fields(...)` and become top-level keys next to the request id
+and client that the context callable supplies. User text is logged through
+describe_text, which by the LOG_PROMPTS policy records only its length and a
+hash ('hash'), a truncated preview ('truncate') or all of it ('full').
+High-volume events pass `sampled=True` and are kept at LOG_SAMPLE_RATE;
+only INFO and DEBUG records are sampled, so warnings and errors are always kept.
+"""
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import hashlib
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else was passed in extra
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+def log_fields(sampled=False, **fields):
+    """extra= for a structured record; sampled marks a high-volume event"""
+    return {'fields': fields, 'sampled': sampled}
+
+class TextPolicy:
+    def __init__(self, mode='hash', max_chars=80):
+        if mode not in ('hash', 'truncate', 'full'):
+            raise ValueError(f"LOG_PROMPTS must be 'hash', 'truncate' or 'full', got {mode}")
+        self.mode = mode
+        self.max_chars = max_chars
+
+    def describe(self, text):
+        """What gets logged about a piece of user text"""
+        text = text or ''
+        described = {"chars": len(text), "sha256": hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}
+        if self.mode == 'full':
+            described["text"] = text
+        elif self.mode == 'truncate':
+            described["preview"] = text[:self.max_chars] + ('…' if len(text) > self.max_chars else '')
+        return described
+
+text_policy = TextPolicy()
+
+def describe_text(text):
+    return text_policy.describe(text)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        # Context such as request_id, attached on the request thread, then the record's fields;
+        # neither can overwrite the standard keys
+        extra = {key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES}
+        extra.update(extra.pop('fields', None) or {})
+        extra.pop('sampled', None)
+        for key, value in extra.items():
+            entry.setdefault(key, value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records marked sampled at INFO or below"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or record.levelno > logging.INFO or self.rate >= 1:
+            return True
+        if random.random() < self.rate:
+            record.sample_rate = self.rate  # Lets whoever counts these scale them back up
+            return True
+        self.dropped += 1
+        return False
+
+class ContextFilter(logging.Filter):
+    """Attach the fields context() returns, e.g. the current request id, before the record is queued"""
+
+    def __init__(self, context):
+        super().__init__()
+        self.context = context
+
+    def filter(self, record):
+        try:
+            for key, value in (self.context() or {}).items():
+                setattr(record, key, value)
+        except Exception:
+            pass  # Context is best effort; never lose the record over it
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or raising when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class AsyncLogging:
+    def __init__(self, handler, listener, sampler):
+        self.handler = handler
+        self.listener = listener
+        self.sampler = sampler
+
+    def stats(self):
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped_queue_full": self.handler.dropped,
+            "dropped_sampled": self.sampler.dropped,
+            "sample_rate": self.sampler.rate,
+            "prompts": text_policy.mode
+        }
+
+    def stop(self):
+        """Write out the records still queued"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+def configure_logging(context=None, background=True):
+    """Route the root logger through the queue, configured by LOG_* environment variables.
+
+    context is called on the thread that logs each record and returns fields
+    to add to it. Returns the AsyncLogging, whose stop() flushes the queue.
+    With background=False, for processes that may be frozen between requests
+    such as serverless functions, records are written as they are logged and
+    None is returned.
+    """
+    global text_policy
+    text_policy = TextPolicy(
+        os.environ.get('LOG_PROMPTS', 'hash').lower(), int(os.environ.get('LOG_PROMPT_CHARS', 80))
+    )
+    output = logging.StreamHandler(sys.stderr)
+    if os.environ.get('LOG_FORMAT', 'json').lower() == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'))
+
+    sampler = SamplingFilter(float(os.environ.get('LOG_SAMPLE_RATE', 0.1)))
+    handler = output if not background else DroppingQueueHandler(
+        queue.Queue(int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+    )
+    handler.addFilter(sampler)
+    if context is not None:
+        handler.addFilter(ContextFilter(context))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    if not background:
+        return None
+    listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    async_logging = AsyncLogging(handler, listener, sampler)
+    atexit.register(async_logging.stop)
+    return async_logging
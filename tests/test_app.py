@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from stub_ollama import start_stub_server
+
+@pytest.fixture(scope='module')
+def client():
+    stub, url = start_stub_server(latency=0.01)
+    os.environ.update(
+        OLLAMA_API_URL=url, SERVER_TIMING='1', MODEL_WARMUP='0',
+        RATE_LIMIT_BACKEND='none', RESPONSE_CACHE_BACKEND='none'
+    )
+    import app
+    yield app.app.test_client()
+    stub.shutdown()
+
+def server_timing_stages(response):
+    return {entry.split(';')[0].strip() for entry in response.headers['Server-Timing'].split(',')}
+
+def test_server_timing_includes_ollama(client):
+    response = client.post('/chat', json={'message': 'how do I reverse a list in python?'})
+    assert response.status_code == 200
+    assert {'queue', 'generate', 'ollama'} <= server_timing_stages(response)
+
+def test_server_timing_includes_ollama_for_chunked_prompts(client):
+    message = "Review these functions.\n" + "\n".join(
+        f"def f{i}(x):\n    return x * {i} + helper(x, {i})" for i in range(60)
+    )
+    response = client.post('/chat', json={'message': message})
+    assert response.status_code == 200
+    assert 'ollama' in server_timing_stages(response)
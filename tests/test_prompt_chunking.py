@@ -0,0 +1,39 @@
+from prompt_chunking import split_prompt, estimate_tokens
+
+UNFENCED_FUNCTION = """Why does this return the wrong total? Please fix it.
+def total(items):
+    result = 0
+    for item in items:
+        if item.price > 0:
+            result += item.price * item.quantity
+    return result
+
+class Cart:
+    def __init__(self):
+        self.items = []
+"""
+
+def test_short_prompt_is_one_chunk():
+    assert split_prompt("What is a closure?", max_tokens=200) == ["What is a closure?"]
+
+def test_unfenced_code_keeps_lines_and_indentation():
+    chunks = split_prompt(UNFENCED_FUNCTION, max_tokens=40, overlap_tokens=0)
+    assert len(chunks) > 1
+    lines = [line for chunk in chunks for line in chunk.split('\n')]
+    for line in UNFENCED_FUNCTION.split('\n')[1:]:
+        if line.strip():
+            assert line in lines
+    assert "    return result\n\nclass Cart:" in '\n'.join(chunks)
+
+def test_sentences_of_a_line_are_joined_with_spaces():
+    prompt = " ".join(f"Sentence number {i} is here." for i in range(40))
+    chunks = split_prompt(prompt, max_tokens=50, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert all('\n' not in chunk for chunk in chunks)
+    assert all(estimate_tokens(chunk) <= 50 for chunk in chunks)
+
+def test_fenced_block_is_not_cut():
+    block = "```python\n" + "\n".join(f"x{i} = {i}" for i in range(5)) + "\n```"
+    prompt = "Explain this code. " * 20 + "\n" + block
+    chunks = split_prompt(prompt, max_tokens=60, overlap_tokens=0)
+    assert any(block in chunk for chunk in chunks)
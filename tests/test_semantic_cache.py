@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from semantic_cache import HashingEmbedder, SemanticCache
+
+def make_cache():
+    return SemanticCache(HashingEmbedder(), max_size=16)
+
+def test_reworded_question_matches():
+    cache = make_cache()
+    cache.set("reverse a list in python", "use reversed()")
+    answer, similarity = cache.get("how do I reverse a Python list?")
+    assert answer == "use reversed()"
+    assert similarity >= cache.threshold
+
+def test_reversed_conversion_does_not_match():
+    cache = make_cache()
+    cache.set("convert a string to an int in python", "int(s)")
+    answer, similarity = cache.get("convert an int to a string in python")
+    assert answer is None
+    assert similarity < cache.threshold
+
+def test_answers_are_kept_per_namespace():
+    cache = make_cache()
+    cache.set("reverse a list in python", "use reversed()", namespace='codellama')
+    assert cache.get("reverse a list in python", namespace='llama3')[0] is None
@@ -0,0 +1,10 @@
+"""Production entry point for app.py.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+`python app.py` starts Flask's development server, which is only meant for
+local use.
+"""
+from app import app
+
+application = app  # The name most WSGI servers look for by default